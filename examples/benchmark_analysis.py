@@ -0,0 +1,43 @@
+import time
+import tracemalloc
+import numpy as np
+from x3p import X3Pfile, analysis
+# Compare analysis.height_parameters with a naive implementation using
+# numpy.ma on the whole surface (several full size temporaries), on a
+# synthetic float32 surface of 4000 x 4000 points with 5% invalid points.
+size = (4000, 4000)
+rng = np.random.default_rng(0)
+heights = (1e-6 * rng.standard_normal(size)).astype(np.float32)
+anx3pfile = X3Pfile()
+anx3pfile.record1.set_featuretype('SUR')
+anx3pfile.record1.axes.CX.set_axistype('I')
+anx3pfile.record1.axes.CY.set_axistype('I')
+anx3pfile.set_data(np.ma.masked_array(heights,
+                                      mask=rng.random(size) < 0.05))
+
+
+def naive(data):
+    z = data.astype(np.float64) * anx3pfile.record1.axes.CZ.increment
+    deviations = z - z.mean()
+    Sq = np.sqrt((deviations**2).mean())
+    return {'Sa': np.abs(deviations).mean(),
+            'Sq': Sq,
+            'Sp': deviations.max(),
+            'Sv': -deviations.min(),
+            'Sz': deviations.max() - deviations.min(),
+            'Ssk': (deviations**3).mean() / Sq**3,
+            'Sku': (deviations**4).mean() / Sq**4}
+
+
+for name, function in [('naive numpy.ma', lambda: naive(anx3pfile.data)),
+                       ('height_parameters',
+                        lambda: analysis.height_parameters(anx3pfile))]:
+    tracemalloc.start()
+    t = time.perf_counter()
+    result = function()
+    t = time.perf_counter() - t
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print("%-18s %7.3f s %8.1f MB peak" % (name, t, peak / 1e6))
+    print("    " + ", ".join("%s=%.6g" % (key, result[key])
+                             for key in analysis.PARAMETERS))
@@ -0,0 +1,37 @@
+import os
+import time
+import tempfile
+import numpy as np
+from x3p import X3Pfile
+# Write throughput and file size of X3Pfile.write for the different
+# compression methods, using a synthetic surface (a smooth form plus noise)
+# stored as float32, float64 and int16.
+size = (1000, 1000)
+x, y = np.meshgrid(np.linspace(-1, 1, size[1]), np.linspace(-1, 1, size[0]))
+rng = np.random.default_rng(0)
+heights = 1e-4 * (x**2 + y**2) + 1e-7 * rng.standard_normal(size)
+surfaces = {'float32': heights.astype(np.float32),
+            'float64': heights,
+            'int16': (heights / heights.max() * 30000).astype(np.int16)}
+settings = [('stored', None), ('deflate', 1), ('deflate', 6), ('bzip2', 9),
+            ('lzma', None)]
+tmpdir = tempfile.mkdtemp()
+print("%-8s %-8s %5s %10s %10s %8s" % ('dtype', 'method', 'level', 'MB/s',
+                                         'size MB', 'ratio'))
+for name, surface in surfaces.items():
+    anx3pfile = X3Pfile()
+    anx3pfile.record1.set_featuretype('SUR')
+    anx3pfile.record1.axes.CX.set_axistype('I')
+    anx3pfile.record1.axes.CY.set_axistype('I')
+    anx3pfile.record2 = None
+    anx3pfile.set_data(surface)
+    for compression, level in settings:
+        filepath = os.path.join(tmpdir, 'bench.x3p')
+        t = time.perf_counter()
+        anx3pfile.write(filepath, compression=compression, level=level)
+        t = time.perf_counter() - t
+        filesize = os.path.getsize(filepath)
+        print("%-8s %-8s %5s %10.1f %10.2f %8.2f" % (
+            name, compression, level, surface.nbytes / t / 1e6,
+            filesize / 1e6, surface.nbytes / filesize))
+        os.remove(filepath)
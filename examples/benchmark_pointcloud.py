@@ -0,0 +1,43 @@
+import os
+import sys
+import time
+import tempfile
+import numpy as np
+from x3p import X3Pfile, X3PWriter
+# Throughput of X3Pfile.export_pointcloud on a synthetic float32 surface with
+# 5% of invalid points. The surface has 10000 x 10000 = 100M points by default
+# (about 2.4 GB of PLY output), a smaller size can be given as argument:
+#     python benchmark_pointcloud.py 2000
+side = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+tmpdir = tempfile.mkdtemp()
+filepath = os.path.join(tmpdir, 'surface.x3p')
+metadata = X3Pfile()
+metadata.record1.set_featuretype('SUR')
+metadata.record1.axes.CX.set_axistype('I')
+metadata.record1.axes.CX.set_increment(1e-6)
+metadata.record1.axes.CY.set_axistype('I')
+metadata.record1.axes.CY.set_increment(1e-6)
+metadata.record2 = None
+rng = np.random.default_rng(0)
+with X3PWriter(filepath, metadata) as writer:
+    for x0 in range(0, side, 500):
+        rows = min(500, side - x0)
+        block = 1e-6 * rng.standard_normal((rows, side)).astype(np.float32)
+        writer.write_rows(np.ma.masked_array(
+            block, mask=rng.random((rows, side)) < 0.05))
+print("%s points (%.0f MB of point data)" % (side * side,
+                                            side * side * 4 / 1e6))
+print("%-4s %-8s %12s %10s %10s" % ('fmt', 'dtype', 'points', 'Mpts/s',
+                                     'MB/s'))
+for fmt, dtype in [('ply', np.float32), ('ply', np.float64),
+                   ('npy', np.float64)]:
+    anx3pfile = X3Pfile(filepath, lazy=True, verify='off')
+    output = os.path.join(tmpdir, 'cloud.' + fmt)
+    t = time.perf_counter()
+    count = anx3pfile.export_pointcloud(output, fmt, dtype=dtype)
+    t = time.perf_counter() - t
+    print("%-4s %-8s %12d %10.1f %10.1f" % (
+        fmt, np.dtype(dtype).name, count, count / t / 1e6,
+        os.path.getsize(output) / t / 1e6))
+    os.remove(output)
+os.remove(filepath)
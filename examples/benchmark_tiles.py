@@ -0,0 +1,36 @@
+import os
+import tempfile
+import time
+import numpy as np
+from x3p import X3Pfile
+# Compare reading a column strip and a small window of a deflate compressed
+# surface of 6000 x 6000 float32 points in the standard layout (the rows of
+# bindata/data.bin are decompressed up to the end of the window) and in the
+# tiled layout written by write_tiled (only the tiles covering the window
+# are decompressed).
+size = (6000, 6000)
+rng = np.random.default_rng(0)
+heights = np.cumsum(rng.standard_normal(size).astype(np.float32), axis=1)
+anx3pfile = X3Pfile()
+anx3pfile.record1.set_featuretype('SUR')
+anx3pfile.record1.axes.CX.set_axistype('I')
+anx3pfile.record1.axes.CY.set_axistype('I')
+anx3pfile.record2 = None
+anx3pfile.set_data(heights)
+with tempfile.TemporaryDirectory() as directory:
+    standard = os.path.join(directory, 'standard.x3p')
+    tiled = os.path.join(directory, 'tiled.x3p')
+    anx3pfile.write(standard, compression='deflate')
+    anx3pfile.write_tiled(tiled, tile=1024)
+
+    for path in [standard, tiled]:
+        surface = X3Pfile(path, lazy=True)
+        t = time.perf_counter()
+        surface.read_region(y0=3000, y1=3100)
+        strip = time.perf_counter() - t
+        t = time.perf_counter()
+        surface.read_region(5000, 5200, 5000, 5200)
+        window = time.perf_counter() - t
+        print("%-12s %6.1f MB  strip %6.3f s  window %6.3f s"
+              % (os.path.basename(path), os.path.getsize(path) / 1e6, strip,
+                 window))
@@ -0,0 +1,33 @@
+import timeit
+import numpy as np
+from x3p._bindata import decode_validpoints
+# Compare the old list comprehension used by X3Pfile.load for decoding
+# bindata/valids.bin with the numpy decoder, for both layouts.
+npoints = 2000 * 2000
+rng = np.random.default_rng(0)
+valids = rng.random(npoints) > 0.1
+bytes_layout = valids.astype(np.uint8).tobytes()
+packed_layout = np.packbits(valids, bitorder='little').tobytes()
+
+
+def list_comprehension():
+    mask = [0 if b == 1 else 1 for b in bytes_layout]
+    return np.ma.masked_array(np.zeros(npoints), mask=mask)
+
+
+def numpy_bytes():
+    mask = decode_validpoints(bytes_layout, npoints)
+    return np.ma.masked_array(np.zeros(npoints), mask=mask)
+
+
+def numpy_packed():
+    mask = decode_validpoints(packed_layout, npoints)
+    return np.ma.masked_array(np.zeros(npoints), mask=mask)
+
+
+assert (numpy_bytes().mask == list_comprehension().mask).all()
+assert (numpy_packed().mask == ~valids).all()
+print("Decoding the valid points of %s points:" % npoints)
+for func in [list_comprehension, numpy_bytes, numpy_packed]:
+    t = min(timeit.repeat(func, number=1, repeat=3))
+    print("%20s: %8.4f s" % (func.__name__, t))
@@ -0,0 +1,55 @@
+import os
+import numpy as np
+import pytest
+from x3p import X3Pfile, load_many
+
+
+def _write_surface(path, heights):
+    surface = X3Pfile()
+    surface.record1.set_featuretype('SUR')
+    surface.record1.axes.CX.set_axistype('I')
+    surface.record1.axes.CY.set_axistype('I')
+    surface.record2 = None
+    surface.set_data(heights)
+    surface.write(path)
+
+
+def _write_files(directory):
+    heights = np.ma.masked_array(np.arange(12.).reshape(3, 4))
+    heights[1, 2] = np.ma.masked
+    _write_surface(os.path.join(directory, 'surface.x3p'), heights)
+    _write_surface(os.path.join(directory, 'unmasked.x3p'),
+                   np.arange(12.).reshape(3, 4))
+    profile = X3Pfile()
+    profile.record1.set_featuretype('PRF')
+    profile.record1.axes.CX.set_axistype('I')
+    profile.record1.axes.CY.set_axistype('I')
+    for ax in [profile.record1.axes.CX, profile.record1.axes.CY,
+               profile.record1.axes.CZ]:
+        ax.set_datatype('D')
+    profile.record2 = None
+    profile.record3.datalink = False
+    profile.record3.matrixdimension.set_sizeX(15)
+    profile.record3.matrixdimension.set_sizeY(1)
+    profile.record3.matrixdimension.set_sizeZ(1)
+    profile.data = np.arange(15.).reshape(1, 15)
+    profile.write(os.path.join(directory, 'profile.x3p'))
+    return [os.path.join(directory, name) for name in
+            ['surface.x3p', 'unmasked.x3p', 'profile.x3p']]
+
+
+@pytest.mark.parametrize('executor', ['thread', 'process'])
+def test_same_data_types_as_x3pfile(tmp_path, executor):
+    paths = _write_files(str(tmp_path))
+    results = dict((path, (x3pfile, error)) for path, x3pfile, error in
+                   load_many(paths, workers=2, executor=executor))
+    for path in paths:
+        x3pfile, error = results[path]
+        assert error is None
+        expected = X3Pfile(path).data
+        assert type(x3pfile.data) is type(expected)
+        assert x3pfile.data.shape == expected.shape
+        assert np.array_equal(np.ma.getmaskarray(x3pfile.data),
+                              np.ma.getmaskarray(expected))
+        assert np.array_equal(np.ma.getdata(x3pfile.data),
+                              np.ma.getdata(expected))
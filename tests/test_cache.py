@@ -0,0 +1,124 @@
+import glob
+import os
+import shutil
+import subprocess
+import sys
+import numpy as np
+import pytest
+from x3p import X3Pfile, X3PCache, X3PDiskCache, ChecksumError
+
+
+def _write_surface(path, masked):
+    anx3pfile = X3Pfile()
+    anx3pfile.record1.set_featuretype('SUR')
+    anx3pfile.record1.axes.CX.set_axistype('I')
+    anx3pfile.record1.axes.CY.set_axistype('I')
+    anx3pfile.record2 = None
+    heights = np.arange(12.).reshape(3, 4)
+    if masked:
+        heights = np.ma.masked_array(heights, mask=heights == 5)
+    anx3pfile.set_data(heights)
+    anx3pfile.write(path)
+
+
+@pytest.mark.parametrize('masked', [False, True])
+def test_cached_data_can_not_be_modified(tmp_path, masked):
+    first = os.path.join(str(tmp_path), 'surface.x3p')
+    _write_surface(first, masked)
+    second = os.path.join(str(tmp_path), 'copy.x3p')
+    shutil.copy(first, second)
+    cache = X3PCache(1 << 20)
+    anx3pfile = X3Pfile(first, cache=cache)
+    # the file that added the entry shares it with the later hits
+    with pytest.raises(ValueError):
+        anx3pfile.data[0, 0] = 12345
+    with pytest.raises(ValueError):
+        np.ma.getdata(anx3pfile.data)[0, 0] = 12345
+    anx3pfile.level()
+    other = X3Pfile(second, cache=cache)
+    assert other.infos['PointData'] == 'cache'
+    assert other.data[0, 0] == 0
+    assert other.data[2, 3] == 11
+
+
+def test_deferred_loads_are_checked(tmp_path):
+    path = os.path.join(str(tmp_path), 'surface.x3p')
+    _write_surface(path, masked=True)
+    cache = X3PCache(1 << 20)
+    # data whose check is deferred are not shared
+    X3Pfile(path, verify='deferred', cache=cache)
+    assert len(cache) == 0
+    anx3pfile = X3Pfile(path, lazy=True)
+    key = anx3pfile._cache_key(anx3pfile._point_dtype()[0],
+                               anx3pfile._get_shape())
+    corrupt = np.ma.masked_array(np.ones((3, 4)), mask=False)
+    cache.put(key, corrupt, verified=False)
+    # unverified entries are not served to eager loads
+    assert X3Pfile(path, cache=cache).infos['PointData'] == 'read'
+    cache.put(key, corrupt, verified=False)
+    deferred = X3Pfile(path, verify='deferred', cache=cache)
+    assert deferred.infos['PointData'] == 'cache'
+    with pytest.raises(ChecksumError):
+        deferred.verify()
+    X3Pfile(path, cache=cache)
+    cached = X3Pfile(path, verify='deferred', cache=cache)
+    assert cached.infos['PointData'] == 'cache'
+    assert cached.verify()
+
+
+def _corrupt(directory):
+    for path in glob.glob(os.path.join(directory, '*.npy')):
+        if not path.endswith('.mask.npy'):
+            array = np.load(path)
+            array[0, 0] += 1
+            np.save(path, array)
+
+
+def test_disk_cache_entries_failing_the_check_are_replaced(tmp_path):
+    path = os.path.join(str(tmp_path), 'surface.x3p')
+    directory = os.path.join(str(tmp_path), 'cache')
+    _write_surface(path, masked=True)
+    cache = X3PDiskCache(directory)
+    X3Pfile(path, cache=cache)
+    _corrupt(directory)
+    # the eager check misses and the entry is replaced
+    repaired = X3Pfile(path, cache=cache)
+    assert repaired.infos['PointData'] == 'read'
+    assert repaired.data[0, 0] == 0
+    again = X3Pfile(path, cache=cache)
+    assert again.infos['PointData'] == 'cache'
+    assert again.data[0, 0] == 0
+    # a deferred load is served the corrupt entry, verify() finds it
+    _corrupt(directory)
+    deferred = X3Pfile(path, verify='deferred', cache=cache)
+    assert deferred.infos['PointData'] == 'cache'
+    with pytest.raises(ChecksumError):
+        deferred.verify()
+
+
+def test_disk_cache_entries_of_different_layouts(tmp_path):
+    directory = os.path.join(str(tmp_path), 'cache')
+    cache = X3PDiskCache(directory)
+    array = np.ma.masked_array(np.arange(12.).reshape(3, 4))
+    key = ('0' * 32, '', str(np.lib.format.dtype_to_descr(array.dtype)),
+           (3, 4), 1)
+    other = key[:3] + ((4, 3), 1)
+    cache.put(key, array)
+    cache.put(other, array.reshape(4, 3))
+    assert cache.get(key).shape == (3, 4)
+    assert cache.get(other).shape == (4, 3)
+    assert cache.stats() == {'hits': 2, 'misses': 0}
+
+
+def test_cleanup_command(tmp_path):
+    directory = os.path.join(str(tmp_path), 'cache')
+    cache = X3PDiskCache(directory)
+    key = ('0' * 32, '', '<f8', (3, 4), 1)
+    cache.put(key, np.ma.masked_array(np.zeros((3, 4))))
+    result = subprocess.run([sys.executable, '-W', 'error', '-m', 'x3p',
+                             'cleanup-cache', directory],
+                            capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.dirname(
+                                os.path.abspath(__file__))))
+    assert result.returncode == 0, result.stderr
+    assert os.listdir(directory) == []
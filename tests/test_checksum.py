@@ -0,0 +1,39 @@
+import hashlib
+import os
+import re
+import zipfile
+import numpy as np
+import pytest
+from x3p import X3Pfile
+
+
+def test_missing_binary_checksums_are_not_verified(tmp_path):
+    path = os.path.join(str(tmp_path), 'surface.x3p')
+    heights = np.ma.masked_array(np.arange(12.).reshape(3, 4))
+    heights[0, 3] = np.ma.masked
+    anx3pfile = X3Pfile()
+    anx3pfile.record1.set_featuretype('SUR')
+    anx3pfile.record1.axes.CX.set_axistype('I')
+    anx3pfile.record1.axes.CY.set_axistype('I')
+    anx3pfile.record2 = None
+    anx3pfile.set_data(heights)
+    anx3pfile.write(path)
+    # the checksums of the binary members are optional in main.xml
+    with zipfile.ZipFile(path) as zin:
+        mainxml = zin.read('main.xml').decode('utf-8')
+        members = dict((name, zin.read(name)) for name in
+                       ['bindata/data.bin', 'bindata/valids.bin'])
+    mainxml = re.sub('<MD5Checksum(PointData|ValidPoints)>[^<]*'
+                     '</MD5Checksum(PointData|ValidPoints)>', '', mainxml)
+    mainxml = mainxml.encode('utf-8')
+    with zipfile.ZipFile(path, 'w') as zout:
+        zout.writestr('main.xml', mainxml)
+        zout.writestr('md5checksum.hex',
+                      hashlib.md5(mainxml).hexdigest() + ' *main.xml')
+        for name, content in members.items():
+            zout.writestr(name, content)
+    with pytest.warns(UserWarning):
+        loaded = X3Pfile(path)
+    assert np.array_equal(loaded.data.filled(-1), heights.filled(-1))
+    with pytest.warns(UserWarning):
+        assert loaded.verify()
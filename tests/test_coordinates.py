@@ -0,0 +1,89 @@
+import os
+import zipfile
+import numpy as np
+from x3p import X3Pfile
+
+
+def _write_surface(path, heights):
+    anx3pfile = X3Pfile()
+    anx3pfile.record1.set_featuretype('SUR')
+    anx3pfile.record1.axes.CX.set_axistype('I')
+    anx3pfile.record1.axes.CY.set_axistype('I')
+    anx3pfile.record1.axes.CX.set_increment(1e-6)
+    anx3pfile.record1.axes.CY.set_increment(2e-6)
+    anx3pfile.record2 = None
+    anx3pfile.set_data(heights)
+    anx3pfile.write(path, compression='deflate')
+
+
+def _count_opens(monkeypatch):
+    opened = []
+    open_member = zipfile.ZipFile.open
+
+    def counting_open(self, name, *args, **kwargs):
+        opened.append(getattr(name, 'filename', name))
+        return open_member(self, name, *args, **kwargs)
+
+    monkeypatch.setattr(zipfile.ZipFile, 'open', counting_open)
+    return opened
+
+
+def test_coordinate_blocks_of_compressed_files(tmp_path, monkeypatch):
+    path = os.path.join(str(tmp_path), 'surface.x3p')
+    rng = np.random.default_rng(0)
+    heights = np.ma.masked_array(rng.random((20, 7)),
+                                 mask=rng.random((20, 7)) < 0.2)
+    _write_surface(path, heights)
+    X, Y, Z = X3Pfile(path).coordinates()
+    lazy = X3Pfile(path, lazy=True)
+    opened = _count_opens(monkeypatch)
+    blocks = list(lazy.coordinates(chunk_rows=3))
+    assert len(blocks) == 7
+    for full, part in zip([X, Y, Z], zip(*blocks)):
+        assert np.array_equal(full, np.concatenate(part), equal_nan=True)
+    assert opened.count('bindata/data.bin') == 1
+
+
+def test_export_pointcloud_of_compressed_files(tmp_path, monkeypatch):
+    path = os.path.join(str(tmp_path), 'surface.x3p')
+    heights = np.ma.masked_array(np.arange(140.).reshape(20, 7),
+                                 mask=np.arange(140).reshape(20, 7) % 9 == 0)
+    _write_surface(path, heights)
+    X, Y, Z = X3Pfile(path).coordinates()
+    valid = ~np.isnan(Z)
+    lazy = X3Pfile(path, lazy=True)
+    opened = _count_opens(monkeypatch)
+    output = os.path.join(str(tmp_path), 'points.npy')
+    count = lazy.export_pointcloud(output, format='npy', chunk_rows=3)
+    assert opened.count('bindata/data.bin') == 1
+    assert count == np.count_nonzero(valid)
+    points = np.load(output)
+    assert np.array_equal(points, np.stack([X[valid], Y[valid], Z[valid]],
+                                           axis=1))
+
+
+def test_rotation_keeps_the_axis_values_of_invalid_points():
+    anx3pfile = X3Pfile()
+    anx3pfile.record1.set_featuretype('SUR')
+    anx3pfile.record1.axes.CX.set_axistype('I')
+    anx3pfile.record1.axes.CY.set_axistype('I')
+    anx3pfile.record2 = None
+    heights = np.ma.masked_array(np.arange(12.).reshape(3, 4),
+                                 mask=np.arange(12).reshape(3, 4) == 5)
+    anx3pfile.set_data(heights)
+    # rotation about Z: X and Y do not depend on the heights
+    angle = 0.3
+    anx3pfile.record1.axes.rotation = np.array(
+        [[np.cos(angle), -np.sin(angle), 0],
+         [np.sin(angle), np.cos(angle), 0], [0, 0, 1]])
+    anx3pfile.infos['Rotation'] = True
+    X, Y, Z = anx3pfile.coordinates()
+    assert np.isnan(Z[1, 1]) and np.count_nonzero(np.isnan(Z)) == 1
+    assert not np.isnan(X).any() and not np.isnan(Y).any()
+    assert np.isclose(X[1, 1], np.cos(angle) - np.sin(angle))
+    # a tilt mixes the heights in X
+    anx3pfile.record1.axes.rotation = np.array(
+        [[np.cos(angle), 0, np.sin(angle)], [0, 1, 0],
+         [-np.sin(angle), 0, np.cos(angle)]])
+    X, Y, Z = anx3pfile.coordinates()
+    assert np.isnan(X[1, 1]) and not np.isnan(Y).any()
@@ -0,0 +1,26 @@
+import numpy as np
+import pytest
+from x3p import _datalist
+
+
+@pytest.mark.parametrize('npoints', [0, 7, 10, 15, 20])
+def test_decoder_keeps_points_beyond_matrixdimension(npoints):
+    # batches of 4 points: with 7 and 10 expected points a batch fits only
+    # partly in the preallocated array
+    decoder = _datalist.DatalistDecoder(npoints, batch_size=4)
+    for i in range(15):
+        decoder.add(str(i))
+    result = decoder.result(np.float64)
+    assert result.shape == (15, 1)
+    assert np.array_equal(result.ravel(), np.arange(15))
+
+
+def test_decode_datalist():
+    points = _datalist.decode_datalist(['1;2;3', None, '4; 5;6\n'],
+                                       np.float64)
+    assert np.array_equal(points, [[1, 2, 3], [np.nan] * 3, [4, 5, 6]],
+                          equal_nan=True)
+    with pytest.raises(ValueError):
+        _datalist.decode_datalist(['1;2', '3'], np.float64)
+    with pytest.raises(ValueError):
+        _datalist.decode_datalist(['1;x'], np.float64)
@@ -0,0 +1,44 @@
+import os
+import zipfile
+import numpy as np
+from x3p import X3Pfile, filters
+
+
+def test_tiled_filter_of_a_lazy_file_in_an_out_array(tmp_path, monkeypatch):
+    rng = np.random.default_rng(0)
+    spacing = (2e-6, 3e-6)
+    mask = rng.random((120, 90)) < 0.1
+    heights = np.ma.masked_array(rng.standard_normal((120, 90)) * 1e-6,
+                                 mask=mask)
+    path = os.path.join(str(tmp_path), 'surface.x3p')
+    anx3pfile = X3Pfile()
+    anx3pfile.record1.set_featuretype('SUR')
+    anx3pfile.record1.axes.CX.set_axistype('I')
+    anx3pfile.record1.axes.CX.set_increment(spacing[0])
+    anx3pfile.record1.axes.CY.set_axistype('I')
+    anx3pfile.record1.axes.CY.set_increment(spacing[1])
+    anx3pfile.record2 = None
+    anx3pfile.set_data(heights)
+    anx3pfile.write(path, compression='deflate')
+    full = filters.gaussian_filter(heights, 25e-6, 'highpass',
+                                   spacing=spacing)
+    assert np.array_equal(full.mask, mask)
+
+    opened = []
+    open_member = zipfile.ZipFile.open
+
+    def counting_open(self, name, *args, **kwargs):
+        opened.append(getattr(name, 'filename', name))
+        return open_member(self, name, *args, **kwargs)
+
+    monkeypatch.setattr(zipfile.ZipFile, 'open', counting_open)
+    lazy = X3Pfile(path, lazy=True)
+    out = np.lib.format.open_memmap(os.path.join(str(tmp_path), 'out.npy'),
+                                    'w+', np.float64, (120, 90))
+    # tiles of 32 points with margins of 13 rows: the bands overlap
+    result = filters.gaussian_filter(lazy, 25e-6, 'highpass', tile=32,
+                                     out=out)
+    assert result is out
+    assert opened.count('bindata/data.bin') == 1
+    assert np.isnan(out[mask]).all()
+    assert np.allclose(out[~mask], full.data[~mask], rtol=0, atol=1e-12)
@@ -0,0 +1,23 @@
+import numpy as np
+from x3p import _levelling
+
+
+def test_robust_fit_ignores_gross_outliers():
+    rng = np.random.default_rng(0)
+    nx, ny = 120, 90
+    u = np.linspace(-1, 1, nx)[:, np.newaxis]
+    v = np.linspace(-1, 1, ny)[np.newaxis, :]
+    plane = 0.5 + 2.0 * u - 3.0 * v
+    heights = plane + rng.normal(0, 1e-3, (nx, ny))
+    # 15% of spikes far above the plane, and a masked corner
+    outliers = rng.random((nx, ny)) < 0.15
+    heights[outliers] += rng.uniform(50, 100, np.count_nonzero(outliers))
+    mask = np.zeros((nx, ny), dtype=bool)
+    mask[:10, :10] = True
+    heights[mask] = np.nan
+    surface = np.ma.masked_array(heights, mask=mask)
+    expected = np.array([[0.5, -3.0], [2.0, 0.0]])
+    lstsq = _levelling.fit(surface, 1, 'lstsq', chunk_rows=7)
+    assert not np.allclose(lstsq, expected, atol=1e-2)
+    robust = _levelling.fit(surface, 1, 'robust', chunk_rows=7)
+    assert np.allclose(robust, expected, atol=1e-3)
@@ -0,0 +1,79 @@
+import hashlib
+import os
+import zipfile
+import numpy as np
+from x3p import X3Pfile
+
+
+def _write_surface(path, heights):
+    anx3pfile = X3Pfile()
+    anx3pfile.record1.set_featuretype('SUR')
+    anx3pfile.record1.axes.CX.set_axistype('I')
+    anx3pfile.record1.axes.CY.set_axistype('I')
+    anx3pfile.record2 = None
+    anx3pfile.set_data(heights)
+    anx3pfile.write(path, compression='deflate')
+
+
+def test_build_pyramid_after_level_keeps_archive_valid(tmp_path):
+    path = os.path.join(str(tmp_path), 'surface.x3p')
+    heights = np.add.outer(np.arange(60.), np.arange(80.))
+    _write_surface(path, heights)
+    anx3pfile = X3Pfile(path)
+    # the data in memory no longer match bindata/data.bin
+    anx3pfile.level()
+    assert anx3pfile.build_pyramid(2) == 2
+    stored = X3Pfile(path)
+    assert stored.verify()
+    assert np.array_equal(stored.data, heights)
+    # the pyramid is computed from the stored data
+    level = stored.load_level(1)
+    assert np.allclose(level, heights.reshape(30, 2, 40, 2).mean(axis=(1, 3)))
+
+
+def test_build_pyramid_leaves_the_file_untouched(tmp_path):
+    path = os.path.join(str(tmp_path), 'surface.x3p')
+    heights = np.ma.masked_array(np.arange(1200.).reshape(30, 40),
+                                 mask=np.arange(1200).reshape(30, 40) % 7 == 0)
+    anx3pfile = X3Pfile()
+    anx3pfile.record1.set_featuretype('SUR')
+    anx3pfile.record1.axes.CX.set_axistype('I')
+    anx3pfile.record1.axes.CY.set_axistype('I')
+    anx3pfile.record1.axes.set_rotation(1, 2, 0.5)
+    anx3pfile.infos['Rotation'] = True
+    record2 = anx3pfile.record2
+    record2.set_date('2020-06-14T18:30:29')
+    record2.set_calibrationdate('2020-01-01T00:00:00')
+    record2.instrument.set_manufacturer('Maker')
+    record2.instrument.set_model('Model')
+    record2.instrument.set_serial('1234')
+    record2.instrument.set_version('1.0')
+    record2.probingsystem.set_type('NonContacting')
+    record2.probingsystem.set_identification('lens')
+    anx3pfile.set_data(heights)
+    anx3pfile.write(path)
+    # an element unknown to X3Pfile, the checksum of main.xml is updated
+    with zipfile.ZipFile(path) as zfile:
+        members = [(info, zfile.read(info)) for info in zfile.infolist()]
+    mainxml = dict((info.filename, data) for info, data in members)['main.xml']
+    mainxml = mainxml.replace(b'</Record2>',
+                              b'<Unknown>kept as is</Unknown></Record2>')
+    with zipfile.ZipFile(path, 'w') as zf:
+        for info, data in members:
+            if info.filename == 'main.xml':
+                data = mainxml
+            elif info.filename == 'md5checksum.hex':
+                data = (hashlib.md5(mainxml).hexdigest() + " *main.xml")
+            zf.writestr(info, data)
+    with open(path, 'rb') as f:
+        before = f.read()
+    assert b'<r12>0.5</r12>' in mainxml and b'<Record2>' in mainxml
+    loaded = X3Pfile(path)
+    assert loaded.verify()
+    assert loaded.build_pyramid(1) == 1
+    with open(path, 'rb') as f:
+        assert f.read() == before
+    assert X3Pfile(path).verify()
+    level = loaded.load_level(1)
+    assert level.shape == (15, 20)
+    assert np.allclose(level, heights.reshape(15, 2, 20, 2).mean(axis=(1, 3)))
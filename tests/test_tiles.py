@@ -0,0 +1,85 @@
+import os
+import zipfile
+import numpy as np
+import pytest
+from x3p import X3Pfile
+
+
+def _surface(heights):
+    anx3pfile = X3Pfile()
+    anx3pfile.record1.set_featuretype('SUR')
+    anx3pfile.record1.axes.CX.set_axistype('I')
+    anx3pfile.record1.axes.CY.set_axistype('I')
+    anx3pfile.record2 = None
+    anx3pfile.set_data(heights)
+    return anx3pfile
+
+
+def _count_opens(monkeypatch):
+    opened = []
+    open_member = zipfile.ZipFile.open
+
+    def counting_open(self, name, mode='r', *args, **kwargs):
+        if mode == 'r':
+            opened.append(getattr(name, 'filename', name))
+        return open_member(self, name, mode, *args, **kwargs)
+
+    monkeypatch.setattr(zipfile.ZipFile, 'open', counting_open)
+    return opened
+
+
+@pytest.mark.parametrize('shape', [(23, 17), (2, 23, 17)])
+def test_tiled_windows_match_the_full_load(tmp_path, shape):
+    rng = np.random.default_rng(0)
+    heights = rng.random(shape)
+    mask = rng.random(shape) < 0.2
+    # invalid first and last rows and columns, NaN under some of the mask
+    mask[..., 0, :] = mask[..., -1, :] = True
+    mask[..., :, 0] = mask[..., :, -1] = True
+    heights[mask & (rng.random(shape) < 0.5)] = np.nan
+    heights = np.ma.masked_array(heights, mask=mask)
+    path = os.path.join(str(tmp_path), 'tiled.x3p')
+    # tiles of 5 x 4 points: the last row and column of tiles are partial
+    _surface(heights).write_tiled(path, tile=(5, 4))
+    full = X3Pfile(path).data
+    assert np.array_equal(full.mask, mask)
+    assert np.array_equal(full.filled(-1), heights.filled(-1))
+    lazy = X3Pfile(path, lazy=True)
+    for x0, x1, y0, y1 in [(0, 23, 0, 17), (20, 23, 16, 17), (4, 11, 3, 9),
+                           (0, 1, 0, 17), (22, 23, 0, 17), (0, 23, 16, 17),
+                           (19, 23, 12, 17), (7, 8, 9, 10), (3, 3, 0, 17)]:
+        for layer in range(shape[0]) if len(shape) == 3 else [None]:
+            region = lazy.read_region(x0, x1, y0, y1, layer=layer)
+            expected = full[x0:x1, y0:y1] if layer is None \
+                else full[layer, x0:x1, y0:y1]
+            assert region.shape == expected.shape
+            assert np.array_equal(np.ma.getmaskarray(region),
+                                  np.ma.getmaskarray(expected))
+            assert np.array_equal(np.ma.filled(region, -1),
+                                  np.ma.filled(expected, -1))
+
+
+@pytest.mark.parametrize('shape', [(23, 17), (3, 23, 17)])
+def test_tiled_and_standard_copies_read_in_one_pass(tmp_path, monkeypatch,
+                                                    shape):
+    rng = np.random.default_rng(1)
+    heights = np.ma.masked_array(rng.random(shape),
+                                 mask=rng.random(shape) < 0.2)
+    path = os.path.join(str(tmp_path), 'surface.x3p')
+    _surface(heights).write(path, compression='deflate')
+    opened = _count_opens(monkeypatch)
+    tiled = os.path.join(str(tmp_path), 'tiled.x3p')
+    X3Pfile(path, lazy=True).write_tiled(tiled, tile=(2, 8))
+    assert opened.count('bindata/data.bin') == 1
+    assert opened.count('bindata/valids.bin') == 1
+    # back in the standard layout, reading a deflated file in blocks
+    standard = os.path.join(str(tmp_path), 'standard.x3p')
+    X3Pfile(tiled, lazy=True).export_standard(standard, 'deflate')
+    del opened[:]
+    copy = os.path.join(str(tmp_path), 'copy.x3p')
+    X3Pfile(standard, lazy=True).export_standard(copy)
+    assert opened.count('bindata/data.bin') == 1
+    result = X3Pfile(copy)
+    assert result.verify()
+    assert np.array_equal(result.data.mask, heights.mask)
+    assert np.array_equal(result.data.filled(-1), heights.filled(-1))
@@ -0,0 +1,104 @@
+import hashlib
+import os
+import zipfile
+import numpy as np
+import pytest
+from x3p import X3Pfile
+
+
+def _write_bitpacked(path, heights, compression):
+    '''
+    Write the surface with the valid points packed one bit per point, as
+    specified by ISO 5436-2 (X3Pfile.write uses a byte per point).
+    '''
+    anx3pfile = X3Pfile()
+    anx3pfile.record1.set_featuretype('SUR')
+    anx3pfile.record1.axes.CX.set_axistype('I')
+    anx3pfile.record1.axes.CY.set_axistype('I')
+    anx3pfile.record2 = None
+    anx3pfile.set_data(heights)
+    packed = np.packbits(~np.ma.getmaskarray(heights).ravel(),
+                         bitorder='little').tobytes()
+    anx3pfile.record3.datalink.set_MD5ChecksumValidPoints(
+        hashlib.md5(packed).hexdigest())
+    with zipfile.ZipFile(path, 'w', compression) as zf:
+        anx3pfile._write_mainxml_member(zf)
+        zf.writestr('bindata/data.bin', np.ma.getdata(heights).tobytes())
+        zf.writestr('bindata/valids.bin', packed)
+
+
+@pytest.mark.parametrize('compression', [zipfile.ZIP_STORED,
+                                         zipfile.ZIP_DEFLATED])
+def test_region_of_bitpacked_valids(tmp_path, compression):
+    path = os.path.join(str(tmp_path), 'surface.x3p')
+    rng = np.random.default_rng(0)
+    # 3 layers of 13 x 11 points: the rows and the layers do not start on
+    # a byte boundary
+    shape = (3, 13, 11)
+    heights = np.ma.masked_array(rng.random(shape),
+                                 mask=rng.random(shape) < 0.3)
+    _write_bitpacked(path, heights, compression)
+    full = X3Pfile(path)
+    assert full.infos['Verified']
+    assert np.array_equal(np.ma.getmaskarray(full.data),
+                          np.ma.getmaskarray(heights))
+    lazy = X3Pfile(path, lazy=True)
+    for x0, x1, y0, y1 in [(0, 13, 0, 11), (1, 4, 3, 10), (5, 6, 7, 8),
+                           (7, 13, 1, 11), (12, 13, 0, 3), (3, 9, 5, 5)]:
+        for layer in range(shape[0]):
+            region = lazy.read_region(x0, x1, y0, y1, layer=layer)
+            expected = heights[layer, x0:x1, y0:y1]
+            assert np.array_equal(np.ma.getmaskarray(region),
+                                  np.ma.getmaskarray(expected))
+            assert np.array_equal(np.ma.getdata(region),
+                                  np.ma.getdata(expected))
+        region = lazy.read_region(x0, x1, y0, y1)
+        assert np.array_equal(np.ma.getmaskarray(region),
+                              np.ma.getmaskarray(heights[:, x0:x1, y0:y1]))
+    mapped = X3Pfile(path, lazy=True, mmap=True)
+    for layer in range(shape[0]):
+        assert np.array_equal(np.ma.getmaskarray(mapped.layers[layer]),
+                              np.ma.getmaskarray(heights[layer]))
+
+
+@pytest.mark.parametrize('compression', [zipfile.ZIP_STORED,
+                                         zipfile.ZIP_DEFLATED])
+@pytest.mark.parametrize('bitpacked', [False, True])
+def test_rows_read_in_one_pass(tmp_path, monkeypatch, compression,
+                               bitpacked):
+    path = os.path.join(str(tmp_path), 'surface.x3p')
+    rng = np.random.default_rng(1)
+    shape = (2, 13, 11)
+    heights = np.ma.masked_array(rng.random(shape),
+                                 mask=rng.random(shape) < 0.3)
+    if bitpacked:
+        _write_bitpacked(path, heights, compression)
+    else:
+        anx3pfile = X3Pfile()
+        anx3pfile.record1.set_featuretype('SUR')
+        anx3pfile.record1.axes.CX.set_axistype('I')
+        anx3pfile.record1.axes.CY.set_axistype('I')
+        anx3pfile.record2 = None
+        anx3pfile.set_data(heights)
+        anx3pfile.write(path, compression='stored'
+                        if compression == zipfile.ZIP_STORED else 'deflate')
+    lazy = X3Pfile(path, lazy=True)
+    opened = []
+    open_member = zipfile.ZipFile.open
+
+    def counting_open(self, name, *args, **kwargs):
+        opened.append(getattr(name, 'filename', name))
+        return open_member(self, name, *args, **kwargs)
+
+    monkeypatch.setattr(zipfile.ZipFile, 'open', counting_open)
+    for layer in range(shape[0]):
+        # blocks of 3 rows of 11 points: the bit-packed blocks share bytes
+        blocks = list(lazy._iter_rows(layer, 3))
+        assert [x0 for x0, _ in blocks] == [0, 3, 6, 9, 12]
+        rows = np.ma.concatenate([block for _, block in blocks])
+        assert np.array_equal(np.ma.getmaskarray(rows),
+                              np.ma.getmaskarray(heights[layer]))
+        assert np.array_equal(rows.filled(-1), heights[layer].filled(-1))
+    # each member is opened once per pass
+    assert opened.count('bindata/data.bin') <= shape[0]
+    assert opened.count('bindata/valids.bin') <= shape[0]
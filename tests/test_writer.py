@@ -0,0 +1,49 @@
+import os
+import zipfile
+import numpy as np
+import pytest
+from x3p import X3Pfile, X3PWriter
+from x3p import _bindata
+
+
+def _metadata():
+    anx3pfile = X3Pfile()
+    anx3pfile.record1.set_featuretype('SUR')
+    anx3pfile.record1.axes.CX.set_axistype('I')
+    anx3pfile.record1.axes.CY.set_axistype('I')
+    anx3pfile.record2 = None
+    return anx3pfile
+
+
+@pytest.mark.parametrize('chunk_size', [7, _bindata.CHUNK_SIZE])
+def test_valid_points_staged_from_first_invalid(tmp_path, chunk_size,
+                                                monkeypatch):
+    monkeypatch.setattr(_bindata, 'CHUNK_SIZE', chunk_size)
+    path = os.path.join(str(tmp_path), 'surface.x3p')
+    heights = np.ma.masked_array(np.arange(60.).reshape(10, 6))
+    heights[7, 2] = np.ma.masked
+    with X3PWriter(path, _metadata()) as writer:
+        for x0 in range(0, 10, 3):
+            writer.write_rows(heights[x0:x0 + 3])
+    loaded = X3Pfile(path)
+    assert loaded.infos['Verified']
+    assert np.array_equal(loaded.data.filled(-1), heights.filled(-1))
+
+
+def test_no_valid_points_member_when_all_valid(tmp_path):
+    path = os.path.join(str(tmp_path), 'surface.x3p')
+    heights = np.ma.masked_array(np.arange(60.).reshape(10, 6), mask=False)
+    with X3PWriter(path, _metadata()) as writer:
+        writer.write_rows(heights)
+    with zipfile.ZipFile(path) as zf:
+        assert 'bindata/valids.bin' not in zf.namelist()
+    assert np.array_equal(X3Pfile(path).data, heights)
+
+
+def test_incomplete_file_removed(tmp_path):
+    path = os.path.join(str(tmp_path), 'surface.x3p')
+    with pytest.raises(RuntimeError):
+        with X3PWriter(path, _metadata()) as writer:
+            writer.write_rows(np.zeros((3, 4)))
+            raise RuntimeError("acquisition failed")
+    assert not os.path.exists(path)
@@ -1 +1,3 @@
 from .x3p import *
+from .batch import load_many
+from .cache import X3PCache, X3PDiskCache
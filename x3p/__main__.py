@@ -0,0 +1,32 @@
+from __future__ import print_function
+import argparse
+from .cache import cleanup
+"""
+Command line tools of the package:
+
+    python -m x3p cleanup-cache DIR --max-bytes N
+"""
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m x3p',
+        description='Tools for .x3p files and their caches.')
+    subparsers = parser.add_subparsers(dest='command')
+    clean = subparsers.add_parser(
+        'cleanup-cache',
+        help='remove the least recently used files of an X3PDiskCache '
+             'directory')
+    clean.add_argument('directory')
+    clean.add_argument('--max-bytes', type=int, default=0,
+                       help='size to keep (default 0: remove everything)')
+    args = parser.parse_args(args)
+    if args.command == 'cleanup-cache':
+        removed = cleanup(args.directory, args.max_bytes)
+        print("Removed %s bytes from %s" % (removed, args.directory))
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+from __future__ import print_function
+import hashlib
+import struct
+import zipfile
+import numpy as np
+"""
+Helpers for decoding the binary members (bindata/*.bin) of an .x3p archive.
+These functions work directly on the buffers read from the zip file and avoid
+any per-point Python loop.
+"""
+# Size of the blocks used when streaming the members of the archive.
+CHUNK_SIZE = 1 << 20
+
+
+def decode_validpoints(buffer, npoints):
+    '''
+    Decode the content of the valid points member into a boolean mask where
+    True marks an invalid point (numpy.ma convention).
+
+    Two layouts are supported:
+        - one byte per point, as written by X3Pfile.write (1 means valid);
+        - one bit per point, as specified by ISO 5436-2, the first point is
+          stored in the least significant bit of the first byte. When the
+          buffer is shorter than the number of points the missing points are
+          considered valid.
+    '''
+    raw = np.frombuffer(buffer, dtype=np.uint8)
+    if raw.size == npoints:
+        return raw != 1
+    if raw.size <= (npoints + 7) // 8:
+        bits = np.unpackbits(raw, bitorder='little')[:npoints]
+        mask = np.zeros(npoints, dtype=bool)
+        mask[:bits.size] = bits == 0
+        return mask
+    raise ValueError("Valid points buffer of %s bytes does not match %s points."
+                     % (raw.size, npoints))
+
+
+def point_mask(array, ncomp=1):
+    '''
+    Return the mask of a point data array with a value per point: a point is
+    invalid if any of its values is masked. Structured arrays have a mask per
+    field, plain arrays with ncomp values per point along the last axis a
+    mask per value.
+    '''
+    mask = np.ma.getmaskarray(array)
+    if mask.dtype.names:
+        mask = np.logical_or.reduce([mask[name] for name in mask.dtype.names])
+    if ncomp > 1:
+        mask = mask.any(axis=-1)
+    return mask
+
+
+def valids_checksum(mask, expected):
+    '''
+    Return the md5 checksum of the valid points of a mask (True marks an
+    invalid point) in the layout, a byte or a bit per point, whose checksum
+    is the expected one (the byte layout if neither matches).
+    '''
+    checksum = md5_array(mask, invert=True)
+    if checksum == expected.lower():
+        return checksum
+    packed = np.packbits(~np.ravel(mask), bitorder='little')
+    packed = md5_array(packed)
+    return packed if packed == expected.lower() else checksum
+
+
+def member_offset(zfile, name):
+    '''
+    Return the position in the archive of the first byte of the member
+    content. None is returned when the member is compressed or encrypted,
+    because in that case its content can not be mapped directly.
+    '''
+    info = zfile.getinfo(name)
+    if info.compress_type != zipfile.ZIP_STORED or info.flag_bits & 0x1:
+        return None
+    # The local file header has a fixed part of 30 bytes followed by the
+    # file name and the extra field, their lengths can differ from the ones
+    # in the central directory.
+    zfile.fp.seek(info.header_offset)
+    header = zfile.fp.read(30)
+    signature, namelength, extralength = struct.unpack('<4s22xHH', header)
+    if signature != b'PK\x03\x04':
+        raise zipfile.BadZipFile("Bad local header for %s" % name)
+    return info.header_offset + 30 + namelength + extralength
+
+
+def md5_member(zfile, name, chunk_size=CHUNK_SIZE):
+    '''
+    Compute the md5 checksum of a member of the archive reading it in chunks.
+    '''
+    md5 = hashlib.md5()
+    with zfile.open(name) as member:
+        for chunk in iter(lambda: member.read(chunk_size), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def read_ranges(zfile, name, ranges):
+    '''
+    Read a list of byte ranges (start, count) of a member, the ranges must be
+    sorted and must not overlap (see MemberReader).
+    '''
+    reader = MemberReader(zfile, name)
+    try:
+        return b''.join([reader.read(start, count) for start, count in ranges])
+    finally:
+        reader.close()
+
+
+class MemberReader(object):
+    '''
+    Read byte ranges of a member keeping it open, the ranges must be read in
+    increasing order. Stored members are read seeking directly in the
+    archive, compressed members are decompressed in a single pass and the
+    bytes before each range are discarded, so reading a member block by
+    block decompresses it only once. A range may start in the previous one
+    (bit-packed rows can share a byte), the bytes already read are then
+    taken from it.
+    '''
+    def __init__(self, zfile, name):
+        self.zfile = zfile
+        self.size = zfile.getinfo(name).file_size
+        self.offset = member_offset(zfile, name)
+        self.member = zfile.open(name) if self.offset is None else None
+        self.position = 0
+        self.last = b''
+
+    def read(self, start, count):
+        head = b''
+        if start < self.position:
+            first = self.position - len(self.last)
+            if start < first:
+                raise ValueError("Range at %s before the ranges read." % start)
+            head = self.last[start - first:start - first + count]
+            count -= len(head)
+            start = self.position
+        if self.member is None:
+            self.zfile.fp.seek(self.offset + start)
+            data = self.zfile.fp.read(max(min(count, self.size - start), 0))
+        else:
+            # seeking forward a compressed member reads and discards
+            self.member.seek(start)
+            data = self.member.read(count)
+        if data:
+            self.position = start + len(data)
+            self.last = data
+        return head + data
+
+    def close(self):
+        if self.member is not None:
+            self.member.close()
+
+
+def read_member(zfile, name, dtype, md5=None, chunk_size=CHUNK_SIZE):
+    '''
+    Read a member of the archive in a new numpy array of the given dtype.
+    The member is streamed in chunks directly in the buffer of the array, if
+    an md5 object is given it is updated on the way.
+    '''
+    dtype = np.dtype(dtype)
+    size = zfile.getinfo(name).file_size
+    array = np.empty(size // dtype.itemsize, dtype=dtype)
+    view = memoryview(array).cast('B')
+    position = 0
+    with zfile.open(name) as member:
+        while position < len(view):
+            n = member.readinto(view[position:position + chunk_size])
+            if n == 0:
+                raise zipfile.BadZipFile("Unexpected end of %s" % name)
+            if md5 is not None:
+                md5.update(view[position:position + n])
+            position += n
+    return array
+
+
+def iter_blocks(array, invert=False, chunk_size=CHUNK_SIZE):
+    '''
+    Yield C-contiguous blocks of an array along the first axis, the bytes of
+    the blocks concatenated are the same as array.tobytes() but no full copy
+    of the array is made. When invert is True the logical not of the array is
+    yielded (the valid points are the inverse of the mask).
+    '''
+    array = np.asarray(array)
+    if array.ndim == 0:
+        array = array.reshape(1)
+    step = max(1, chunk_size // max(1, array[:1].nbytes))
+    for start in range(0, array.shape[0], step):
+        block = np.ascontiguousarray(array[start:start + step])
+        if invert:
+            block = ~block
+        yield block
+
+
+def md5_array(array, invert=False, chunk_size=CHUNK_SIZE):
+    '''
+    Compute the md5 checksum of the bytes of an array in C order (as written
+    by tobytes) hashing it in blocks (see iter_blocks).
+    '''
+    md5 = hashlib.md5()
+    for block in iter_blocks(array, invert, chunk_size):
+        md5.update(block)
+    return md5.hexdigest()
+
+
+def write_array(zf, name, array, invert=False, chunk_size=CHUNK_SIZE):
+    '''
+    Write the bytes of an array in a new member of the archive in blocks
+    (see iter_blocks).
+    '''
+    with zf.open(name, 'w', force_zip64=True) as member:
+        for block in iter_blocks(array, invert, chunk_size):
+            member.write(block)
+
+
+class HashingReader(object):
+    '''
+    File-like wrapper that updates an md5 object with the bytes read, so a
+    member can be hashed while it is parsed.
+    '''
+    def __init__(self, fileobj, md5):
+        self.fileobj = fileobj
+        self.md5 = md5
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.md5.update(data)
+        return data
+
+    def close(self):
+        self.fileobj.close()
+
+
+class HashingWriter(object):
+    '''
+    File-like wrapper that updates an md5 object with the bytes written, so
+    a member can be hashed while it is written.
+    '''
+    def __init__(self, fileobj, md5):
+        self.fileobj = fileobj
+        self.md5 = md5
+
+    def write(self, data):
+        self.md5.update(data)
+        return self.fileobj.write(data)
@@ -0,0 +1,131 @@
+from __future__ import print_function
+import numpy as np
+"""
+Helpers for the DataList of Record3, where the points are stored in main.xml
+as Datum elements containing the values of a point separated by ';'.
+"""
+
+
+def decode_datalist(texts, dtype, nvalues=1):
+    '''
+    Decode the texts of the Datum elements of a DataList into an array of
+    shape (len(texts), nvalues). All the texts are joined, split and
+    converted by numpy in a single call. Empty Datum elements (None) are invalid points and
+    become NaN. The number of values of each point is taken from the first
+    valid point, nvalues is used only when all the points are invalid.
+    '''
+    texts = np.array(texts, dtype=object)
+    empty = np.equal(texts, None)
+    dtype = np.dtype(dtype)
+    if empty.all():
+        return np.full((texts.size, nvalues), np.nan, dtype=dtype)
+    nvalues = texts[np.argmin(empty)].count(';') + 1
+    if empty.any():
+        if dtype.kind != 'f':
+            raise ValueError("Invalid points can not be stored in a DataList of integers.")
+        texts[empty] = ";".join(["nan"] * nvalues)
+    try:
+        data = np.array(";".join(texts).split(';'), dtype=dtype)
+    except ValueError as error:
+        raise ValueError("DataList can not be parsed: %s" % error)
+    if data.size != texts.size * nvalues:
+        raise ValueError("All the points of a DataList must have %s values."
+                         % nvalues)
+    return data.reshape(texts.size, nvalues)
+
+
+class DatalistDecoder(object):
+    """
+    Decode the Datum texts of a DataList in batches while main.xml is
+    parsed, so that only one batch of texts is kept in memory.
+    The values are decoded as float64 (which represents exactly all the
+    X3P data types) in an array preallocated for the number of points
+    expected from the MatrixDimension, and converted to the data type of the
+    axes by result().
+    """
+    def __init__(self, npoints=0, nvalues=1, batch_size=65536):
+        self.nvalues = nvalues
+        self.batch_size = batch_size
+        self.texts = []
+        self.out = None
+        self.npoints = npoints
+        # number of points written in out, the points beyond the expected
+        # ones are kept apart in blocks
+        self.filled = 0
+        self.blocks = []
+
+    def add(self, text):
+        self.texts.append(text)
+        if len(self.texts) >= self.batch_size:
+            self._flush()
+
+    def _flush(self):
+        if not self.texts:
+            return
+        block = decode_datalist(self.texts, np.float64, self.nvalues)
+        self.texts = []
+        if self.out is None:
+            self.nvalues = block.shape[1]
+            self.out = np.empty((self.npoints, self.nvalues))
+        elif block.shape[1] != self.nvalues:
+            raise ValueError("All the points of a DataList must have %s values."
+                             % self.nvalues)
+        # more points than expected: the ones that do not fit in out are
+        # kept apart
+        room = min(len(self.out) - self.filled, len(block))
+        self.out[self.filled:self.filled + room] = block[:room]
+        self.filled += room
+        if room < len(block):
+            self.blocks.append(block[room:])
+
+    def result(self, dtype):
+        '''
+        Return the decoded points as an array of shape (points, nvalues).
+        '''
+        self._flush()
+        dtype = np.dtype(dtype)
+        if self.out is None:
+            return np.empty((0, self.nvalues), dtype=dtype)
+        data = self.out[:self.filled]
+        if self.blocks:
+            data = np.concatenate([data] + self.blocks)
+        if dtype.kind != 'f' and np.isnan(data).any():
+            raise ValueError("Invalid points can not be stored in a DataList of integers.")
+        return data.astype(dtype, copy=False)
+
+
+def format_datalist(points, precision=None, chunk_size=65536):
+    '''
+    Yield the Datum elements of points (an array of shape (points, values))
+    as utf-8 encoded bytes. Each chunk of points is formatted with a single
+    % operation on a template repeated for every point, instead of calling
+    str on every value.
+    Points with all the values NaN are invalid and written as empty Datum
+    elements. precision is the number of significant digits of floats, by
+    default the shortest representation that reads back to the same value
+    is used.
+    '''
+    points = np.asarray(points)
+    if points.ndim == 1:
+        points = points.reshape(-1, 1)
+    isfloat = points.dtype.kind == 'f'
+    if not isfloat:
+        fmt = '%d'
+    elif precision is not None:
+        fmt = '%%.%dg' % precision
+    elif points.dtype == np.float32:
+        # 9 significant digits are enough for reading back a float32
+        fmt = '%.9g'
+    else:
+        fmt = '%r'
+    full = '<Datum>' + ';'.join([fmt] * points.shape[1]) + '</Datum>'
+    empty = '<Datum />'
+    for start in range(0, len(points), chunk_size):
+        block = points[start:start + chunk_size]
+        invalid = np.isnan(block).all(axis=1) if isfloat else None
+        if invalid is not None and invalid.any():
+            template = ''.join(np.where(invalid, empty, full).tolist())
+            block = block[~invalid]
+        else:
+            template = full * len(block)
+        yield (template % tuple(block.ravel().tolist())).encode('utf-8')
@@ -0,0 +1,135 @@
+from __future__ import print_function
+import numpy as np
+"""
+Least-squares fit of a polynomial form z = sum c[a, b] u^a v^b (a + b <=
+order) on a grid of heights, where u and v are the row and column indexes
+normalized in [-1, 1]. The normal equations are accumulated block by block
+using the grid structure: for a block of rows the sums of w*u^a*v^b are
+U.T @ W @ V where U and V contain the powers of the row and column
+coordinates, so no design matrix and no coordinate grid are built.
+"""
+# Tukey biweight tuning constant (95% efficiency for normal residuals).
+TUKEY = 4.685
+# Number of residuals sampled for the robust scale estimate.
+SAMPLE_SIZE = 1 << 20
+
+
+def _powers(start, stop, size, degree):
+    '''
+    Powers 0..degree of the normalized coordinates of the indexes
+    start..stop-1 of an axis of the given size, as an array of shape
+    (stop - start, degree + 1).
+    '''
+    index = np.arange(start, stop, dtype=np.float64)
+    u = 2 * index / (size - 1) - 1 if size > 1 else index * 0
+    return u[:, np.newaxis] ** np.arange(degree + 1)
+
+
+def _blocks(surface, chunk_rows):
+    for x0 in range(0, surface.shape[0], chunk_rows):
+        block = surface[x0:x0 + chunk_rows]
+        valid = ~np.ma.getmaskarray(block)
+        z = np.ma.getdata(block).astype(np.float64)
+        # masked points may contain anything (e.g. NaN)
+        valid &= np.isfinite(z)
+        z[~valid] = 0
+        yield x0, z, valid
+
+
+def _form(coefficients, U, V):
+    order = len(coefficients) - 1
+    return U[:, :order + 1] @ coefficients @ V[:, :order + 1].T
+
+
+def _accumulate(surface, order, chunk_rows, coefficients=None, scale=None):
+    '''
+    One pass over the surface: return the coefficients solving the normal
+    equations (weighted with the Tukey biweight of the residuals of
+    coefficients when they are given, scale is the scale of the residuals)
+    and the number of valid points.
+    '''
+    nx, ny = surface.shape
+    V = _powers(0, ny, ny, 2 * order)
+    G = np.zeros((2 * order + 1, 2 * order + 1))
+    h = np.zeros((order + 1, order + 1))
+    count = 0
+    for x0, z, valid in _blocks(surface, chunk_rows):
+        count += np.count_nonzero(valid)
+        U = _powers(x0, x0 + len(z), nx, 2 * order)
+        weights = valid.astype(np.float64)
+        if coefficients is not None:
+            residuals = z - _form(coefficients, U, V)
+            t = residuals / (TUKEY * scale) if scale > 0 \
+                else np.zeros_like(residuals)
+            weights *= np.where(np.abs(t) < 1, (1 - t * t)**2, 0)
+        G += U.T @ weights @ V
+        h += U[:, :order + 1].T @ (weights * z) @ V[:, :order + 1]
+    # normal equations of the terms (a, b) with a + b <= order
+    terms = [(a, b) for a in range(order + 1) for b in range(order + 1 - a)]
+    N = np.array([[G[a1 + a2, b1 + b2] for a2, b2 in terms]
+                  for a1, b1 in terms])
+    rhs = np.array([h[a, b] for a, b in terms])
+    solution = np.linalg.lstsq(N, rhs, rcond=None)[0]
+    result = np.zeros((order + 1, order + 1))
+    for (a, b), value in zip(terms, solution):
+        result[a, b] = value
+    return result, count
+
+
+def _scale(surface, coefficients, chunk_rows, stride):
+    '''
+    Robust scale of the residuals of coefficients: the median absolute
+    deviation of a sample of every stride-th valid residual.
+    '''
+    nx, ny = surface.shape
+    order = len(coefficients) - 1
+    V = _powers(0, ny, ny, order)
+    sample = []
+    for x0, z, valid in _blocks(surface, chunk_rows):
+        U = _powers(x0, x0 + len(z), nx, order)
+        residuals = z - _form(coefficients, U, V)
+        sample.append(np.abs(residuals[valid])[::stride])
+    return 1.4826 * np.median(np.concatenate(sample))
+
+
+def fit(surface, order=1, method='lstsq', chunk_rows=65536, max_iter=10):
+    '''
+    Fit the polynomial form of a 2D masked array of heights and return the
+    coefficients as an (order + 1, order + 1) array c[a, b] (zero for
+    a + b > order). With method 'robust' the fit is repeated with Tukey
+    biweights of the residuals (iteratively reweighted least squares) from
+    the least squares fit, before every pass the scale of the residuals
+    of the current coefficients is their median absolute deviation
+    estimated on a sample of about SAMPLE_SIZE points.
+    '''
+    coefficients, count = _accumulate(surface, order, chunk_rows)
+    if count == 0:
+        raise ValueError("There are no valid points.")
+    if method == 'lstsq':
+        return coefficients
+    stride = max(count // SAMPLE_SIZE, 1)
+    for _ in range(max_iter):
+        scale = _scale(surface, coefficients, chunk_rows, stride)
+        previous = coefficients
+        coefficients, _ = _accumulate(surface, order, chunk_rows,
+                                      coefficients, scale)
+        if np.allclose(coefficients, previous, rtol=1e-9,
+                       atol=1e-9 * (scale + np.abs(previous).max())):
+            break
+    return coefficients
+
+
+def subtract(surface, coefficients, out, chunk_rows=65536):
+    '''
+    Write surface minus the polynomial form in out (it can be surface).
+    '''
+    nx, ny = surface.shape
+    order = len(coefficients) - 1
+    V = _powers(0, ny, ny, order)
+    data = np.ma.getdata(surface)
+    result = np.ma.getdata(out)
+    for x0 in range(0, nx, chunk_rows):
+        U = _powers(x0, min(x0 + chunk_rows, nx), nx, order)
+        form = _form(coefficients, U, V)
+        np.subtract(data[x0:x0 + chunk_rows], form,
+                    out=result[x0:x0 + chunk_rows], casting='unsafe')
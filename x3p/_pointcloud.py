@@ -0,0 +1,87 @@
+from __future__ import print_function
+import numpy as np
+"""
+Writers of point clouds (arrays of shape (points, 3)) given block by block.
+The number of points is known only at the end, so the headers are written
+with a fixed size and rewritten when the file is closed.
+"""
+FORMATS = ['ply', 'xyz', 'npy']
+# Size in bytes of the PLY and .npy headers.
+HEADER_SIZE = 256
+
+
+def _ply_header(dtype, count):
+    kind = 'float' if dtype.itemsize == 4 else 'double'
+    lines = ['ply', 'format binary_little_endian 1.0',
+             'element vertex %d' % count,
+             'property %s x' % kind,
+             'property %s y' % kind,
+             'property %s z' % kind,
+             'end_header']
+    size = len('\n'.join(lines)) + 1
+    # the header is padded with a comment to keep its size constant
+    lines.insert(2, 'comment' + ' ' * (HEADER_SIZE - size - 8))
+    return ('\n'.join(lines) + '\n').encode('ascii')
+
+
+def _npy_header(dtype, count):
+    header = "{'descr': '%s', 'fortran_order': False, 'shape': (%d, 3), }" % (
+        dtype.str, count)
+    # magic string, version 1.0 and length of the header (10 bytes)
+    length = HEADER_SIZE - 10
+    header = header.ljust(length - 1) + '\n'
+    return (b'\x93NUMPY\x01\x00' + np.uint16(length).astype('<u2').tobytes()
+            + header.encode('latin1'))
+
+
+class PointCloudWriter(object):
+    """
+    Write a point cloud in a binary little endian PLY file, in a text file
+    with a point per line (xyz) or in a .npy file. Every block is written
+    with a single write call.
+    """
+    def __init__(self, path, format='ply', dtype=np.float64):
+        if format not in FORMATS:
+            raise ValueError("format must be one of %s." % ", ".join(FORMATS))
+        self.format = format
+        self.dtype = np.dtype(dtype).newbyteorder('<')
+        self.count = 0
+        if self.dtype.kind != 'f':
+            raise ValueError("Point clouds are written as floats.")
+        # 9 significant digits are enough for reading back a float32
+        self._fmt = '%.9g %.9g %.9g\n' if self.dtype.itemsize == 4 \
+            else '%r %r %r\n'
+        self._file = open(path, 'wb')
+        self._header()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _header(self):
+        if self.format == 'ply':
+            self._file.write(_ply_header(self.dtype, self.count))
+        elif self.format == 'npy':
+            self._file.write(_npy_header(self.dtype, self.count))
+
+    def write(self, points):
+        '''
+        Append the points of an array of shape (points, 3).
+        '''
+        if self.format == 'xyz':
+            values = np.asarray(points, dtype=self.dtype).ravel().tolist()
+            data = ((self._fmt * len(points)) % tuple(values)).encode('ascii')
+        else:
+            data = np.ascontiguousarray(points, dtype=self.dtype)
+        self._file.write(data)
+        self.count += len(points)
+
+    def close(self):
+        if self._file.closed:
+            return
+        if self.format != 'xyz':
+            self._file.seek(0)
+            self._header()
+        self._file.close()
@@ -0,0 +1,114 @@
+from __future__ import print_function
+import io
+import json
+import os
+import tempfile
+import zipfile
+import numpy as np
+"""
+Multi-resolution previews of the point data stored in a sidecar zip archive
+next to the .x3p file (the .x3p file name followed by .pyramid), so the .x3p
+file itself is never modified: level n is the mean of the valid points of
+the blocks of 2^n x 2^n points (NaN where a block has no valid point),
+stored as a .npy member. The manifest lists the levels and the checksum of
+the point data they were computed from.
+"""
+SUFFIX = ".pyramid"
+MANIFEST = "manifest.json"
+
+
+def path(filepath):
+    '''
+    Path of the sidecar archive of an .x3p file.
+    '''
+    return filepath + SUFFIX
+
+
+def member(level):
+    return "level%d.npy" % level
+
+
+def block_sums(sums, counts):
+    '''
+    Sum the values and the counts of the valid points in blocks of 2 x 2
+    points (the last row and column are padded when the size is odd).
+    '''
+    nx, ny = sums.shape
+    padding = ((0, nx % 2), (0, ny % 2))
+    if nx % 2 or ny % 2:
+        sums = np.pad(sums, padding)
+        counts = np.pad(counts, padding)
+    shape = (sums.shape[0] // 2, 2, sums.shape[1] // 2, 2)
+    return (sums.reshape(shape).sum(axis=(1, 3)),
+            counts.reshape(shape).sum(axis=(1, 3)))
+
+
+def build(blocks, levels, dtype):
+    '''
+    Compute the levels 1..levels from blocks of rows of the heights (masked
+    arrays with an even number of rows except the last one) and return them
+    as arrays of the given dtype.
+    '''
+    sums, counts = [], []
+    for block in blocks:
+        valid = ~np.ma.getmaskarray(block)
+        values = np.ma.getdata(block).astype(np.float64)
+        valid &= np.isfinite(values)
+        values[~valid] = 0
+        s, c = block_sums(values, valid.astype(np.float64))
+        sums.append(s)
+        counts.append(c)
+    sums, counts = np.concatenate(sums), np.concatenate(counts)
+    result = []
+    for level in range(1, levels + 1):
+        if level > 1:
+            sums, counts = block_sums(sums, counts)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            result.append((sums / counts).astype(dtype))
+    return result
+
+
+def to_bytes(array):
+    stream = io.BytesIO()
+    np.save(stream, array)
+    return stream.getvalue()
+
+
+def from_bytes(data):
+    return np.load(io.BytesIO(data))
+
+
+def manifest(levels, checksum):
+    return json.dumps({
+        'PointData': checksum,
+        'levels': [{'level': n, 'member': member(n), 'factor': 2**n,
+                    'shape': list(array.shape),
+                    'dtype': array.dtype.str}
+                   for n, array in enumerate(levels, 1)]}, indent=1)
+
+
+def write(filepath, levels, checksum):
+    '''
+    Write the sidecar archive of the levels of an .x3p file through a
+    temporary file, so an existing pyramid is replaced only by a complete
+    one.
+    '''
+    handle, tmppath = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(filepath)), suffix='.tmp')
+    os.close(handle)
+    try:
+        with zipfile.ZipFile(tmppath, 'w', zipfile.ZIP_DEFLATED) as zf:
+            for n, array in enumerate(levels, 1):
+                zf.writestr(member(n), to_bytes(array))
+            zf.writestr(MANIFEST, manifest(levels, checksum))
+        os.replace(tmppath, path(filepath))
+    except BaseException:
+        os.remove(tmppath)
+        raise
+
+
+def read_manifest(zfile):
+    '''
+    Return the manifest of the sidecar archive.
+    '''
+    return json.loads(zfile.read(MANIFEST).decode('utf-8'))
@@ -0,0 +1,124 @@
+from __future__ import print_function
+import bz2
+import concurrent.futures
+import json
+import lzma
+import zlib
+import numpy as np
+from . import _bindata
+"""
+Tiled layout of the point data, a vendor extension for random access in
+large surfaces. Every layer is cut in tiles of tile[0] x tile[1] points
+(smaller at the right and bottom borders) and each tile is compressed on its
+own: the data of the points in C order followed, when the surface has
+invalid points, by one byte per point (1 means valid). The compressed tiles
+are concatenated in the stored member tiles/tiles.bin in the order (layer,
+row of tiles, column of tiles) and the index tiles/index.json lists their
+offsets, so a window is read decompressing only the tiles covering it.
+"""
+VENDOR_ID = "https://github.com/giacomomarchioro/pyx3p/tiles"
+INDEX = "tiles/index.json"
+MEMBER = "tiles/tiles.bin"
+
+# compress and decompress functions of the codecs of the tiles, zlib, bz2
+# and lzma release the GIL so the tiles can be (de)compressed in threads
+CODECS = {'stored': (lambda data, level: data, lambda data: data),
+          'deflate': (lambda data, level: zlib.compress(
+                          data, -1 if level is None else level),
+                      zlib.decompress),
+          'bzip2': (lambda data, level: bz2.compress(
+                        data, 9 if level is None else level),
+                    bz2.decompress),
+          'lzma': (lambda data, level: lzma.compress(data), lzma.decompress),
+          }
+
+
+def grid(shape, tile):
+    '''
+    Number of tiles along the rows and the columns of a layer.
+    '''
+    return (-(-shape[0] // tile[0]), -(-shape[1] // tile[1]))
+
+
+def encode(block, mask, codec, level):
+    '''
+    Compress the data of a tile and its mask (None if the surface has no
+    invalid points).
+    '''
+    payload = np.ascontiguousarray(block).tobytes()
+    if mask is not None:
+        payload += (~mask).tobytes()
+    return CODECS[codec][0](payload, level)
+
+
+def index(shape, tile, codec, masked, offsets):
+    return json.dumps({'shape': list(shape), 'tile': list(tile),
+                       'codec': codec, 'masked': masked,
+                       'offsets': offsets})
+
+
+def read_index(zfile):
+    '''
+    Return the index of the tiles of the archive or None if it has none.
+    '''
+    if INDEX not in zfile.namelist():
+        return None
+    return json.loads(zfile.read(INDEX).decode('utf-8'))
+
+
+def read_window(zfile, tiles, dtype, ncomp, layers, x0, nx, y0, ny,
+                workers=None):
+    '''
+    Read the window [x0:x0+nx, y0:y0+ny] of the given layers and return the
+    data as an array of shape (layers, nx, ny, ncomp) and the mask of the
+    points (None if the surface has no invalid points). The compressed tiles
+    covering the window are read in a single pass over tiles/tiles.bin and
+    decompressed by a pool of workers threads.
+    '''
+    sizeZ, sizeX, sizeY = tiles['shape']
+    tx, ty = tiles['tile']
+    ntx, nty = grid((sizeX, sizeY), (tx, ty))
+    offsets = tiles['offsets']
+    decompress = CODECS[tiles['codec']][1]
+    data = np.empty((len(layers), nx, ny, ncomp), dtype=dtype)
+    mask = np.zeros((len(layers), nx, ny), dtype=bool) \
+        if tiles['masked'] else None
+    wanted = []
+    if nx > 0 and ny > 0:
+        for n, z in enumerate(layers):
+            for i in range(x0 // tx, (x0 + nx - 1) // tx + 1):
+                for j in range(y0 // ty, (y0 + ny - 1) // ty + 1):
+                    wanted.append((n, (z * ntx + i) * nty + j, i, j))
+    # the tiles are sorted as in the member
+    wanted.sort(key=lambda item: item[1])
+    ranges = [(offsets[k], offsets[k + 1] - offsets[k])
+              for _, k, _, _ in wanted]
+    buf = memoryview(_bindata.read_ranges(zfile, MEMBER, ranges))
+    starts = np.cumsum([0] + [count for _, count in ranges])
+
+    def decode(position):
+        n, _, i, j = wanted[position]
+        payload = decompress(buf[starts[position]:starts[position + 1]])
+        # size of the tile and its part inside the window
+        rows = min(tx, sizeX - i * tx)
+        columns = min(ty, sizeY - j * ty)
+        xa, xb = max(x0, i * tx), min(x0 + nx, i * tx + rows)
+        ya, yb = max(y0, j * ty), min(y0 + ny, j * ty + columns)
+        inside = (slice(xa - i * tx, xb - i * tx),
+                  slice(ya - j * ty, yb - j * ty))
+        window = (n, slice(xa - x0, xb - x0), slice(ya - y0, yb - y0))
+        count = rows * columns * ncomp
+        block = np.frombuffer(payload, dtype=dtype, count=count)
+        data[window] = block.reshape(rows, columns, ncomp)[inside]
+        if mask is not None:
+            valid = np.frombuffer(payload, dtype=np.uint8,
+                                  offset=count * dtype.itemsize)
+            mask[window] = valid.reshape(rows, columns)[inside] != 1
+
+    if len(wanted) > 1 and workers != 1:
+        with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+            list(pool.map(decode, range(len(wanted))))
+    else:
+        for position in range(len(wanted)):
+            decode(position)
+    return data, mask
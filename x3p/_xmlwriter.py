@@ -0,0 +1,58 @@
+from __future__ import print_function
+from xml.sax.saxutils import escape, quoteattr
+"""
+Minimal streaming XML emitter used for writing main.xml directly in the
+archive, without building an ElementTree and without keeping the serialized
+document in memory.
+"""
+
+
+class XMLEmitter(object):
+    """
+    Write XML elements as utf-8 bytes in a binary stream. The output is
+    buffered and written in blocks of about buffer_size bytes. As with
+    ElementTree.tostring(encoding='utf-8') no XML declaration is written and
+    empty elements are written as <tag />.
+    """
+    def __init__(self, stream, buffer_size=1 << 16):
+        self.stream = stream
+        self.buffer_size = buffer_size
+        self._parts = []
+        self._size = 0
+
+    def _write(self, text):
+        self.raw(text.encode('utf-8'))
+
+    def raw(self, data):
+        '''
+        Write bytes that are already serialized XML.
+        '''
+        self._parts.append(data)
+        self._size += len(data)
+        if self._size >= self.buffer_size:
+            self.flush()
+
+    def start(self, tag, attrib=None):
+        attributes = ''
+        if attrib:
+            attributes = ''.join(' %s=%s' % (key, quoteattr(value))
+                                 for key, value in attrib)
+        self._write('<%s%s>' % (tag, attributes))
+
+    def end(self, tag):
+        self._write('</%s>' % tag)
+
+    def element(self, tag, text=None):
+        '''
+        Write an element containing only text (None for an empty element).
+        '''
+        if text is None:
+            self._write('<%s />' % tag)
+        else:
+            self._write('<%s>%s</%s>' % (tag, escape(text), tag))
+
+    def flush(self):
+        if self._parts:
+            self.stream.write(b''.join(self._parts))
+            self._parts = []
+            self._size = 0
@@ -0,0 +1,155 @@
+from __future__ import print_function
+import numpy as np
+from .x3p import _axis_column, _axis_scale, _chunk_rows
+"""
+Areal height parameters (ISO 25178-2) of the point data of an X3Pfile:
+
+    from x3p import X3Pfile, analysis
+    anx3pfile = X3Pfile('1-euro-star.x3p', lazy=True)
+    analysis.height_parameters(anx3pfile)  # {'Sq': ..., 'Ssk': ..., ...}
+
+The heights are read in blocks of rows (in a single pass over the archive
+for lazily loaded files) and reduced with mergeable central moments, so no full size
+temporary array is created. The parameters are computed on the heights in
+metres (CZ increment and offset applied) relative to their mean: remove the
+form first if needed (e.g. with X3Pfile.level).
+"""
+__all__ = ['Moments', 'height_parameters', 'PARAMETERS']
+
+PARAMETERS = ['Sa', 'Sq', 'Sp', 'Sv', 'Sz', 'Ssk', 'Sku']
+
+
+class Moments(object):
+    """
+    Count, mean, central moments up to the fourth order, minimum and maximum
+    of a set of values. Blocks of values are added with add and partial
+    results (e.g. computed in different threads) are combined with merge,
+    using the pairwise update formulas of Chan et al. and Pebay.
+    """
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        # sums of the powers of the deviations from the mean
+        self.M2 = 0.0
+        self.M3 = 0.0
+        self.M4 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def add(self, values):
+        '''
+        Add a block of values (NaN are ignored).
+        '''
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[~np.isnan(values)]
+        if values.size == 0:
+            return self
+        block = Moments()
+        block.n = values.size
+        block.mean = values.mean()
+        deviations = values - block.mean
+        squares = deviations * deviations
+        block.M2 = squares.sum()
+        block.M3 = np.dot(squares, deviations)
+        block.M4 = np.dot(squares, squares)
+        block.min = values.min()
+        block.max = values.max()
+        return self.merge(block)
+
+    def merge(self, other):
+        '''
+        Combine the moments of other in these moments.
+        '''
+        if other.n == 0:
+            return self
+        if self.n == 0:
+            self.__dict__.update(other.__dict__)
+            return self
+        na, nb = float(self.n), float(other.n)
+        n = na + nb
+        delta = other.mean - self.mean
+        M2 = self.M2 + other.M2 + delta**2 * na * nb / n
+        M3 = (self.M3 + other.M3 + delta**3 * na * nb * (na - nb) / n**2 +
+              3 * delta * (na * other.M2 - nb * self.M2) / n)
+        M4 = (self.M4 + other.M4 +
+              delta**4 * na * nb * (na**2 - na * nb + nb**2) / n**3 +
+              6 * delta**2 * (na**2 * other.M2 + nb**2 * self.M2) / n**2 +
+              4 * delta * (na * other.M3 - nb * self.M3) / n)
+        self.n = self.n + other.n
+        self.mean = self.mean + delta * nb / n
+        self.M2, self.M3, self.M4 = M2, M3, M4
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+
+def _heights(source, layer, chunk_rows):
+    '''
+    Yield blocks of heights in metres with NaN for the invalid points. The
+    source is an X3Pfile or an array (masked or with NaN) of heights.
+    '''
+    if isinstance(source, np.ndarray):
+        source = np.ma.asarray(source)
+        rows = source.reshape(len(source), -1) if source.ndim > 1 \
+            else source.reshape(1, -1)
+        chunk_rows = _chunk_rows(rows.shape[1], chunk_rows)
+        for x0 in range(0, len(rows), chunk_rows):
+            yield np.ma.filled(rows[x0:x0 + chunk_rows].astype(np.float64),
+                               np.nan)
+        return
+    increment, offset = _axis_scale(source.record1.axes.CZ)
+    names = source._point_dtype()[1]
+    for _, block in source._iter_rows(layer, chunk_rows):
+        block = _axis_column(block, 'z', names)
+        heights = np.ma.filled(block.astype(np.float64), np.nan)
+        heights *= increment
+        heights += offset
+        yield heights
+
+
+def height_parameters(source, parameters=None, layer=0, chunk_rows=None):
+    '''
+    Compute the height parameters of an X3Pfile (of a layer) or of an array
+    of heights (masked or with NaN for the invalid points) and return them
+    in a dict, together with the mean height ('mean') and the number of
+    valid points ('n'):
+        - Sq root mean square height;
+        - Sp maximum peak height, Sv maximum pit depth (as a positive
+          value) and Sz = Sp + Sv;
+        - Ssk skewness and Sku kurtosis;
+        - Sa arithmetic mean height.
+    All the parameters except Sa are computed in a single pass over blocks
+    of chunk_rows rows (by default about a million points). Sa needs the
+    mean so it takes a second pass, leave it out of parameters (a list of
+    names, by default PARAMETERS) to skip it.
+    '''
+    if parameters is None:
+        parameters = PARAMETERS
+    unknown = set(parameters) - set(PARAMETERS)
+    if unknown:
+        raise ValueError("Unknown parameters %s." % ", ".join(sorted(unknown)))
+    moments = Moments()
+    for heights in _heights(source, layer, chunk_rows):
+        moments.add(heights)
+    if moments.n == 0:
+        raise ValueError("There are no valid points.")
+    n = moments.n
+    Sq = np.sqrt(moments.M2 / n)
+    results = {'n': n, 'mean': moments.mean,
+               'Sq': Sq,
+               'Sp': moments.max - moments.mean,
+               'Sv': moments.mean - moments.min,
+               'Sz': moments.max - moments.min,
+               'Ssk': moments.M3 / n / Sq**3 if Sq > 0 else np.nan,
+               'Sku': moments.M4 / n / Sq**4 if Sq > 0 else np.nan}
+    if 'Sa' in parameters:
+        total = 0.0
+        for heights in _heights(source, layer, chunk_rows):
+            deviations = heights[~np.isnan(heights)]
+            deviations -= moments.mean
+            total += np.abs(deviations, out=deviations).sum()
+        results['Sa'] = total / n
+    for name in PARAMETERS:
+        if name not in parameters:
+            results.pop(name, None)
+    return results
@@ -0,0 +1,142 @@
+from __future__ import print_function
+import os
+import concurrent.futures
+import numpy as np
+from .x3p import X3Pfile
+try:
+    from multiprocessing import shared_memory
+    from multiprocessing import resource_tracker
+except ImportError:
+    # python < 3.8
+    shared_memory = None
+"""
+Parallel loading of many .x3p files.
+"""
+__all__ = ['load_many']
+
+
+def _to_shared(array):
+    '''
+    Copy an array in a new shared memory block and return its descriptor.
+    The block is not tracked by this process: the process that receives the
+    descriptor is in charge of unlinking it.
+    '''
+    array = np.ascontiguousarray(array)
+    if array.nbytes == 0:
+        return None
+    try:
+        shm = shared_memory.SharedMemory(create=True, size=array.nbytes,
+                                         track=False)
+    except TypeError:
+        # python < 3.13 always tracks the block and would unlink it when
+        # the worker exits.
+        shm = shared_memory.SharedMemory(create=True, size=array.nbytes)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    np.ndarray(array.shape, array.dtype, buffer=shm.buf)[...] = array
+    shm.close()
+    return (shm.name, array.shape, array.dtype)
+
+
+def _from_shared(descriptor, blocks):
+    '''
+    Return an array viewing the shared memory block of the descriptor. The
+    block is unlinked immediately, the mapping stays valid as long as the
+    SharedMemory object (appended to blocks) is alive.
+    '''
+    name, shape, dtype = descriptor
+    shm = shared_memory.SharedMemory(name=name)
+    shm.unlink()
+    blocks.append(shm)
+    return np.ndarray(shape, np.dtype(dtype), buffer=shm.buf)
+
+
+def _unlink(descriptor):
+    if descriptor is not None:
+        shm = shared_memory.SharedMemory(name=descriptor[0])
+        shm.close()
+        shm.unlink()
+
+
+def _load_shared(path, kwargs):
+    '''
+    Worker of the process executor: load the file and move the point data in
+    shared memory, so that only the metadata are pickled.
+    '''
+    x3pfile = X3Pfile(path, **kwargs)
+    data = mask = None
+    # the points of a DataList are a plain array, binary data a masked one
+    masked = isinstance(x3pfile._data, np.ma.MaskedArray)
+    if x3pfile._pending is None and np.size(x3pfile._data) > 0:
+        data = _to_shared(np.ma.getdata(x3pfile._data))
+        if np.ma.getmask(x3pfile._data) is not np.ma.nomask:
+            mask = _to_shared(np.ma.getmaskarray(x3pfile._data))
+        x3pfile._data = np.array([])
+    return x3pfile, data, mask, masked
+
+
+def _attach(result):
+    x3pfile, data, mask, masked = result
+    if data is not None:
+        blocks = []
+        array = _from_shared(data, blocks)
+        if mask is not None:
+            array = np.ma.masked_array(array, mask=_from_shared(mask, blocks))
+        elif masked:
+            array = np.ma.masked_array(array)
+        x3pfile.data = array
+        # keeps the shared memory mapped as long as the file is alive
+        x3pfile._shm = blocks
+    return x3pfile
+
+
+def load_many(paths, workers=None, executor='thread', **kwargs):
+    '''
+    Load many .x3p files in parallel and yield (path, x3pfile, error) as soon
+    as each file is loaded. error is None on success, otherwise x3pfile is
+    None and error is the exception raised while loading that file: the
+    other files are loaded anyway. The keyword arguments are passed to
+    X3Pfile (e.g. lazy=True, verify='off').
+
+    executor can be:
+        - 'thread': the files are loaded in a thread pool, the zlib
+          decompression and the md5 computation release the GIL;
+        - 'process': the files are loaded in a process pool and the point
+          data are handed back through shared memory instead of pickling
+          them (python >= 3.8).
+    workers is the number of threads/processes (default os.cpu_count()).
+    '''
+    if executor == 'thread':
+        pool = concurrent.futures.ThreadPoolExecutor(workers)
+        submit = lambda path: pool.submit(X3Pfile, path, **kwargs)
+    elif executor == 'process':
+        if shared_memory is None:
+            raise NotImplementedError("The process executor needs python >= 3.8.")
+        pool = concurrent.futures.ProcessPoolExecutor(workers or os.cpu_count())
+        submit = lambda path: pool.submit(_load_shared, path, kwargs)
+    else:
+        raise ValueError("executor must be 'thread' or 'process'.")
+    with pool:
+        futures = dict((submit(path), path) for path in paths)
+        pending = set(futures)
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                pending.discard(future)
+                try:
+                    result = future.result()
+                    if executor == 'process':
+                        result = _attach(result)
+                except Exception as error:
+                    yield futures[future], None, error
+                else:
+                    yield futures[future], result, None
+        finally:
+            # if the generator is closed early we cancel what has not
+            # started and free the shared memory of what has been loaded
+            for future in pending:
+                future.cancel()
+            if executor == 'process':
+                for future in pending:
+                    if not future.cancelled() and future.exception() is None:
+                        _, data, mask, _ = future.result()
+                        _unlink(data)
+                        _unlink(mask)
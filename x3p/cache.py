@@ -0,0 +1,256 @@
+from __future__ import print_function
+import os
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+import numpy as np
+from . import _bindata
+"""
+Caches of decoded point data. The entries are keyed by the checksums stored
+in the DataLink of Record3 (plus the data type and the shape), so copies of
+the same file with different names share the same entry.
+"""
+__all__ = ['X3PCache', 'X3PDiskCache']
+
+
+def _nbytes(array):
+    size = np.ma.getdata(array).nbytes
+    if np.ma.getmask(array) is not np.ma.nomask:
+        size += np.ma.getmask(array).nbytes
+    return size
+
+
+def _readonly(array):
+    '''
+    Make the data and the mask read-only because the same array is shared
+    by all the files loaded from the cache (and by the file that added it).
+    '''
+    # np.ma.getdata returns a new view of a masked array: the flag is set on
+    # the array itself so that every view taken later inherits it.
+    array.flags.writeable = False
+    if np.ma.getmask(array) is not np.ma.nomask:
+        np.ma.getmask(array).flags.writeable = False
+    return array
+
+
+class X3PCache(object):
+    """
+    Thread-safe LRU cache of decoded point data bounded by the total size in
+    bytes of the cached arrays (data and mask). It can be passed to X3Pfile
+    (X3Pfile(path, cache=cache)): when the point data are found in the cache
+    the archive members are not read at all.
+
+    The cached arrays are read-only, copy them before modifying them. Files
+    loaded with verify='deferred' do not add their data, and the data they
+    take from the cache are checked by X3Pfile.verify().
+    The counters hits, misses and evictions are available as attributes and
+    with stats().
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = int(max_bytes)
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, verified=False):
+        '''
+        Return the cached array or None. When verified is True only arrays
+        whose checksums have been verified when they were decoded are
+        returned.
+        '''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (verified and not entry[1]):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, array, verified=False):
+        '''
+        Add an array to the cache evicting the least recently used ones if
+        needed. Arrays larger than max_bytes are not cached.
+        '''
+        size = _nbytes(array)
+        if size > self.max_bytes:
+            return
+        _readonly(array)
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= _nbytes(self._entries.pop(key)[0])
+            self._entries[key] = (array, verified)
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self.nbytes -= _nbytes(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        '''
+        Return a dict with the counters and the size of the cache.
+        '''
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'entries': len(self),
+                    'nbytes': self.nbytes, 'max_bytes': self.max_bytes}
+
+
+class X3PDiskCache(object):
+    """
+    Persistent cache of decoded point data stored as .npy files in a
+    directory. It can be passed to X3Pfile like X3PCache: the data are
+    stored in <MD5ChecksumPointData>.<layout>.npy (and the mask in
+    <MD5ChecksumPointData>.<layout>.<MD5ChecksumValidPoints>.mask.npy,
+    layout identifies the data type and the shape) and later loads
+    memory-map these files instead of decompressing the archive.
+
+    When the file is loaded with verify='eager' the mapped arrays are hashed
+    and compared with the checksums stored in the archive before being
+    used, which is still much cheaper than inflating a compressed member.
+    Entries failing the check are replaced by the data read from the
+    archive. With verify='deferred' the arrays are checked by
+    X3Pfile.verify().
+    If max_bytes is given the cache directory is cleaned up (least recently
+    used files first) every time an entry is added, see cleanup().
+    """
+    def __init__(self, directory, max_bytes=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _paths(self, key):
+        md5_data, md5_valids, dtype, shape, ncomp = key
+        # the same point data can be decoded with different data types and
+        # shapes, they are different entries
+        layout = hashlib.md5(repr((dtype, tuple(shape), ncomp)).encode(
+            'utf-8')).hexdigest()[:12]
+        stem = os.path.join(self.directory, '%s.%s' % (md5_data, layout))
+        mask = '%s.%s.mask.npy' % (stem, md5_valids) if md5_valids else None
+        return stem + '.npy', mask
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, key, verified=False):
+        '''
+        Return the memory-mapped array of the entry or None. When verified is
+        True the arrays are checked against the checksums of the key.
+        '''
+        md5_data, md5_valids, dtype, shape, ncomp = key
+        datapath, maskpath = self._paths(key)
+        try:
+            data = np.load(datapath, mmap_mode='r')
+            mask = np.load(maskpath, mmap_mode='r') if maskpath \
+                else np.ma.nomask
+        except (IOError, ValueError):
+            self._count(False)
+            return None
+        # the mask is stored with a value per point
+        pointshape = shape[:-1] if ncomp > 1 else shape
+        if str(np.lib.format.dtype_to_descr(data.dtype)) != dtype or \
+                data.shape != shape or \
+                (maskpath and mask.shape != pointshape):
+            self._count(False)
+            return None
+        if verified and (_bindata.md5_array(data) != md5_data or (
+                maskpath and _bindata.valids_checksum(mask, md5_valids) !=
+                md5_valids)):
+            self._count(False)
+            return None
+        for path in [datapath, maskpath]:
+            if path:
+                # the modification time is used for the cleanup order
+                os.utime(path, None)
+        self._count(True)
+        if maskpath and ncomp > 1:
+            mask = np.repeat(mask[..., np.newaxis], ncomp, axis=-1)
+        return np.ma.masked_array(data, mask=mask)
+
+    def put(self, key, array, verified=False):
+        '''
+        Store the array in the cache directory, replacing the entry if it
+        exists (e.g. when it has failed the check of a load).
+        '''
+        datapath, maskpath = self._paths(key)
+        items = [(datapath, np.ma.getdata(array))]
+        if maskpath:
+            items.append((maskpath, _bindata.point_mask(array, key[4])))
+        for path, item in items:
+            # we write in a temporary file and rename it so that another
+            # process never sees a partial file
+            handle, tmppath = tempfile.mkstemp(dir=self.directory,
+                                               suffix='.tmp')
+            try:
+                with os.fdopen(handle, 'wb') as f:
+                    np.save(f, item)
+                os.replace(tmppath, path)
+            except BaseException:
+                os.remove(tmppath)
+                raise
+        if self.max_bytes is not None:
+            self.cleanup(self.max_bytes)
+
+    def cleanup(self, max_bytes=None):
+        '''
+        Remove the least recently used files until the size of the cache
+        directory is below max_bytes (by default self.max_bytes, 0 removes
+        everything). Return the number of bytes removed.
+        '''
+        return cleanup(self.directory,
+                       self.max_bytes if max_bytes is None else max_bytes)
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+
+def cleanup(directory, max_bytes):
+    '''
+    Remove the least recently used .npy files of a cache directory until its
+    size is below max_bytes. Return the number of bytes removed.
+    '''
+    files = []
+    for name in os.listdir(directory):
+        if name.endswith('.npy'):
+            path = os.path.join(directory, name)
+            stat = os.stat(path)
+            files.append((stat.st_mtime, stat.st_size, path))
+    files.sort()
+    total = sum(size for _, size, _ in files)
+    removed = 0
+    for _, size, path in files:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            # already removed by another process
+            pass
+        total -= size
+        removed += size
+    return removed
+
@@ -0,0 +1,277 @@
+from __future__ import print_function
+import concurrent.futures
+import numpy as np
+from .x3p import _axis_column, _axis_scale, _RowReader
+try:
+    # scipy.fft is faster and can use several threads for a transform
+    import scipy.fft as scipy_fft
+except ImportError:
+    scipy_fft = None
+"""
+FFT based areal filters and spectra of the point data of an X3Pfile:
+
+    from x3p import X3Pfile, filters
+    anx3pfile = X3Pfile('1-euro-star.x3p')
+    roughness = filters.gaussian_filter(anx3pfile, 0.8e-3, 'highpass')
+    frequencies, spectrum = filters.psd(anx3pfile)
+
+The heights are in metres (CZ increment and offset applied) and the
+sampling distances are the increments of the incremental CX and CY axes.
+Arrays of heights can be used too, giving the spacing explicitly.
+"""
+__all__ = ['gaussian_filter', 'psd']
+
+# Constant of the ISO 16610-61 Gaussian weighting function, the transmission
+# is 50% at the cutoff wavelength.
+ALPHA = np.sqrt(np.log(2) / np.pi)
+
+
+def _rfft2(array, shape, workers):
+    if scipy_fft is not None:
+        return scipy_fft.rfft2(array, shape, workers=workers)
+    return np.fft.rfft2(array, shape)
+
+
+def _irfft2(array, shape, workers):
+    if scipy_fft is not None:
+        return scipy_fft.irfft2(array, shape, workers=workers)
+    return np.fft.irfft2(array, shape)
+
+
+def _fast_size(n):
+    '''
+    Smallest size >= n with only the factors 2, 3 and 5.
+    '''
+    if scipy_fft is not None:
+        return scipy_fft.next_fast_len(n, real=True)
+    best = 2 * n
+    power2 = 1
+    while power2 < best:
+        power3 = power2
+        while power3 < best:
+            size = power3
+            while size < n:
+                size *= 5
+            best = min(best, size)
+            power3 *= 3
+        power2 *= 2
+    return best
+
+
+class _Source(object):
+    """
+    Regions of heights (in metres) and of their weights (1 for the valid
+    points) of an X3Pfile layer or of an array.
+    """
+    def __init__(self, source, spacing, layer, dtype):
+        self.dtype = dtype
+        if isinstance(source, np.ndarray):
+            if spacing is None:
+                raise ValueError("The spacing must be given for arrays.")
+            self.array = np.ma.asarray(source)
+            self.shape = self.array.shape
+            self.spacing = spacing
+            return
+        axes = source.record1.axes
+        if axes.get_XYaxes_types() != ['I', 'I']:
+            raise NotImplementedError("Only incremental X and Y axes can be filtered.")
+        md = source.record3.matrixdimension
+        self.x3pfile = source
+        self.array = None
+        self.layer = layer
+        self.names = source._point_dtype()[1]
+        self.shape = (md.sizeX, md.sizeY)
+        self.spacing = spacing or (axes.CX.increment, axes.CY.increment)
+        self.increment, self.offset = _axis_scale(axes.CZ)
+
+    def rows(self, x0, x1, reader=None):
+        '''
+        Heights and weights of the rows x0 to x1, read with reader (a
+        _RowReader) if given.
+        '''
+        if self.array is not None:
+            block = self.array[x0:x1]
+            heights = np.ma.getdata(block).astype(self.dtype)
+        else:
+            if reader is None:
+                block = self.x3pfile.read_region(x0, x1, layer=self.layer)
+            else:
+                block = reader.read(x0, x1, self.layer)
+            block = _axis_column(block, 'z', self.names)
+            heights = np.ma.getdata(block).astype(self.dtype)
+            heights *= self.increment
+            heights += self.offset
+        weights = ~np.ma.getmaskarray(block) & np.isfinite(heights)
+        heights[~weights] = 0
+        return heights, weights.astype(self.dtype)
+
+    def bands(self, tile, margin):
+        '''
+        Yield the first row x0 of the bands of tile rows, the first row xa
+        of the band with its margin and the heights and weights of the rows
+        xa to x0 + tile + margin. Every row is read once: the rows shared
+        with the previous band are kept and lazily loaded files are read in
+        a single pass over the archive.
+        '''
+        nx, ny = self.shape
+        reader = None if self.array is not None else _RowReader(self.x3pfile)
+        heights = np.zeros((0, ny), self.dtype)
+        weights = np.zeros((0, ny), self.dtype)
+        start = stop = 0
+        try:
+            for x0 in range(0, nx, tile):
+                xa, xb = max(x0 - margin, 0), min(x0 + tile + margin, nx)
+                new = self.rows(max(stop, xa), xb, reader)
+                keep = slice(min(xa, stop) - start, stop - start)
+                heights = np.concatenate([heights[keep], new[0]])
+                weights = np.concatenate([weights[keep], new[1]])
+                start, stop = xa, xb
+                yield x0, xa, heights, weights
+        finally:
+            if reader is not None:
+                reader.close()
+
+
+def _transfer(shape, spacing, cutoff, dtype):
+    '''
+    Transfer function of the Gaussian filter on the rfft2 frequencies.
+    '''
+    fx = np.fft.fftfreq(shape[0], spacing[0])
+    fy = np.fft.rfftfreq(shape[1], spacing[1])
+    scale = np.pi * (ALPHA * cutoff)**2
+    return (np.exp(-scale * fx**2)[:, np.newaxis] *
+            np.exp(-scale * fy**2)[np.newaxis, :]).astype(dtype)
+
+
+def gaussian_filter(source, cutoff, kind='lowpass', spacing=None, layer=0,
+                    dtype=np.float64, tile=None, workers=None, out=None):
+    '''
+    Apply the ISO 16610-61 areal Gaussian filter with the cutoff wavelength
+    cutoff (in metres) to an X3Pfile layer or to a 2D array of heights
+    (masked or with NaN for the invalid points, spacing is then the tuple of
+    the sampling distances along the rows and the columns).
+    kind 'lowpass' returns the filtered surface (the form/waviness of an
+    L-filter, the output of an S-filter), 'highpass' the surface minus the
+    filtered one (the roughness).
+
+    The convolution is done with FFTs and normalized by the convolution of
+    the valid points (normalized convolution): invalid points and the area
+    outside the surface do not bias the result and the filtered surface is
+    interpolated at the invalid points (it is nan farther than about a
+    cutoff from any valid point). The result is a masked array with the
+    mask of the input.
+
+    dtype can be np.float32 to halve the memory and speed up the FFTs.
+    With tile the output is computed in square tiles of tile points using
+    overlap-save: each tile is computed with a margin of a cutoff and the
+    bands of tile rows (with their margins) are read one after the other,
+    so lazily loaded files larger than the memory can be filtered in an out
+    array (e.g. a numpy.memmap). With out the result is written in out with
+    nan at the invalid points and out is returned, no mask of the size of
+    the surface is allocated. workers is the number of threads of the FFTs
+    with scipy, or of the tiles of a band processed in parallel without it.
+    '''
+    if kind not in ['lowpass', 'highpass']:
+        raise ValueError("kind must be 'lowpass' or 'highpass'.")
+    dtype = np.dtype(dtype)
+    source = _Source(source, spacing, layer, dtype)
+    nx, ny = source.shape
+    # the weights are below 1e-6 farther than a cutoff
+    margin = [min(int(np.ceil(cutoff / d)), n)
+              for d, n in zip(source.spacing, source.shape)]
+    tile = tile or max(nx, ny)
+    mask = None
+    if out is None:
+        out = np.empty(source.shape, dtype)
+        mask = np.zeros(source.shape, dtype=bool)
+    data = np.ma.getdata(out)
+    transfers = {}
+
+    def filter_tile(x0, y0, xa, heights, weights):
+        x1, y1 = min(x0 + tile, nx), min(y0 + tile, ny)
+        ya, yb = max(y0 - margin[1], 0), min(y1 + margin[1], ny)
+        xb = xa + len(heights)
+        heights, weights = heights[:, ya:yb], weights[:, ya:yb]
+        # zero padding of a margin on every side avoids the wrap around
+        shape = (_fast_size(x1 - x0 + 2 * margin[0]),
+                 _fast_size(y1 - y0 + 2 * margin[1]))
+        stack = np.zeros((2,) + shape, dtype)
+        stack[0, :xb - xa, :yb - ya] = heights
+        stack[1, :xb - xa, :yb - ya] = weights
+        if shape not in transfers:
+            transfers[shape] = _transfer(shape, source.spacing, cutoff, dtype)
+        spectrum = _rfft2(stack, shape, workers)
+        spectrum *= transfers[shape]
+        smooth = _irfft2(spectrum, shape, workers)
+        # the kernel is centred in 0: the output of a point is at its index
+        window = (slice(x0 - xa, x1 - xa), slice(y0 - ya, y1 - ya))
+        numerator, denominator = smooth[0][window], smooth[1][window]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            result = np.where(denominator > 1e-6, numerator / denominator,
+                              np.nan)
+        valid = weights[window] > 0
+        if kind == 'highpass':
+            result = heights[window] - result
+        if mask is None:
+            result[~valid] = np.nan
+        else:
+            mask[x0:x1, y0:y1] = ~valid
+        data[x0:x1, y0:y1] = result
+
+    columns = range(0, ny, tile)
+    pool = None
+    if scipy_fft is None and workers is not None and workers > 1 and \
+            len(columns) > 1:
+        pool = concurrent.futures.ThreadPoolExecutor(workers)
+    try:
+        for x0, xa, heights, weights in source.bands(tile, margin[0]):
+            if pool is None:
+                for y0 in columns:
+                    filter_tile(x0, y0, xa, heights, weights)
+            else:
+                list(pool.map(lambda y0: filter_tile(x0, y0, xa, heights,
+                                                     weights), columns))
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    if mask is None:
+        return out
+    return np.ma.masked_array(data, mask=mask)
+
+
+def psd(source, spacing=None, layer=0, dtype=np.float64, workers=None):
+    '''
+    Return the radially averaged power spectral density of an X3Pfile
+    layer or of a 2D array of heights (see gaussian_filter) as a tuple of
+    arrays (frequencies in 1/m, PSD in m^4). The mean height is removed and
+    the invalid points are set to it; level the surface first to remove the
+    form. The PSD is normalized so that its integral over the frequency
+    plane is the variance of the heights.
+    '''
+    dtype = np.dtype(dtype)
+    source = _Source(source, spacing, layer, dtype)
+    nx, ny = source.shape
+    dx, dy = source.spacing
+    heights, weights = source.rows(0, nx)
+    valid = weights > 0
+    heights[valid] -= heights[valid].mean()
+    spectrum = _rfft2(heights, heights.shape, workers)
+    power = (spectrum.real**2 + spectrum.imag**2) * (dx * dy / (nx * ny))
+    fx = np.fft.fftfreq(nx, dx)
+    fy = np.fft.rfftfreq(ny, dy)
+    radius = np.hypot(fx[:, np.newaxis], fy[np.newaxis, :])
+    # the columns not mirrored by rfft2 count twice in the full plane
+    counts = np.full(fy.shape, 2.0)
+    counts[0] = 1
+    if ny % 2 == 0:
+        counts[-1] = 1
+    counts = np.broadcast_to(counts, radius.shape)
+    step = 1 / max(nx * dx, ny * dy)
+    bins = np.round(radius / step).astype(np.intp).ravel()
+    nbins = int(round(min(0.5 / dx, 0.5 / dy) / step)) + 1
+    keep = bins < nbins
+    total = np.bincount(bins[keep], (power * counts).ravel()[keep], nbins)
+    number = np.bincount(bins[keep], counts.ravel()[keep], nbins)
+    nonempty = number > 0
+    return (np.arange(nbins)[nonempty] * step,
+            total[nonempty] / number[nonempty])
@@ -0,0 +1,159 @@
+from __future__ import print_function
+import os
+import sqlite3
+from .batch import load_many
+"""
+Catalog of the metadata of many .x3p files stored in a SQLite database.
+Only main.xml is parsed (the files are loaded lazily) and a file is parsed
+again only when its modification time or size change:
+
+    from x3p import index
+    index.build('/data/scans', 'catalog.sqlite')
+    paths = index.query('catalog.sqlite', model='ConoProbe-3H',
+                        sizeX__min=1000, date__min='2020-01-01')
+"""
+__all__ = ['build', 'query', 'COLUMNS']
+
+
+def _text(value):
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return value
+
+
+def _record2(attribute):
+    def get(x3pfile):
+        if x3pfile.record2 is None:
+            return None
+        obj = x3pfile.record2
+        for name in attribute.split('.'):
+            obj = getattr(obj, name)
+        return _text(obj)
+    return get
+
+
+def _axis(name, attribute):
+    return lambda x3pfile: getattr(getattr(x3pfile.record1.axes, name),
+                                   attribute)
+
+
+def _checksum(x3pfile):
+    if x3pfile.record3.datalink is False:
+        return None
+    return x3pfile.record3.datalink.MD5ChecksumPointData
+
+
+# Columns of the catalog (besides path, mtime, size and error) and the
+# functions extracting them from a lazily loaded X3Pfile.
+COLUMNS = [
+    ('featuretype', 'TEXT', lambda f: f.record1.featuretype),
+    ('date', 'TEXT', _record2('date')),
+    ('creator', 'TEXT', _record2('creator')),
+    ('manufacturer', 'TEXT', _record2('instrument.manufacturer')),
+    ('model', 'TEXT', _record2('instrument.model')),
+    ('serial', 'TEXT', _record2('instrument.serial')),
+    ('version', 'TEXT', _record2('instrument.version')),
+    ('calibrationdate', 'TEXT', _record2('calibrationdate')),
+    ('probingsystem', 'TEXT', _record2('probingsystem.type')),
+    ('sizeX', 'INTEGER', lambda f: f.record3.matrixdimension.sizeX),
+    ('sizeY', 'INTEGER', lambda f: f.record3.matrixdimension.sizeY),
+    ('sizeZ', 'INTEGER', lambda f: f.record3.matrixdimension.sizeZ),
+    ('checksum', 'TEXT', _checksum),
+]
+for _name in ['CX', 'CY', 'CZ']:
+    COLUMNS += [
+        (_name + '_axistype', 'TEXT', _axis(_name, 'axistype')),
+        (_name + '_datatype', 'TEXT', _axis(_name, 'datatype')),
+        (_name + '_increment', 'REAL', _axis(_name, 'increment')),
+        (_name + '_offset', 'REAL', _axis(_name, 'offset')),
+    ]
+_NAMES = [column[0] for column in COLUMNS]
+
+
+def _connect(db_path):
+    connection = sqlite3.connect(db_path)
+    columns = ", ".join("%s %s" % (name, kind) for name, kind, _ in COLUMNS)
+    connection.execute("CREATE TABLE IF NOT EXISTS files ("
+                       "path TEXT PRIMARY KEY, mtime REAL, size INTEGER, "
+                       "error TEXT, %s)" % columns)
+    return connection
+
+
+def _find(root_dir):
+    for dirpath, _, filenames in os.walk(root_dir):
+        for filename in filenames:
+            if filename.lower().endswith('.x3p'):
+                yield os.path.abspath(os.path.join(dirpath, filename))
+
+
+def build(root_dir, db_path, workers=None):
+    '''
+    Index the metadata of all the .x3p files under root_dir in the SQLite
+    database db_path. Files already indexed with the same modification time
+    and size are skipped, files no longer present are removed from the
+    index. Files that can not be read are stored with the error message so
+    they are not parsed again until they change.
+    Return a dict with the number of files added, updated, removed,
+    unchanged and the number of errors.
+    '''
+    connection = _connect(db_path)
+    root = os.path.join(os.path.abspath(root_dir), '')
+    known = dict((row[0], (row[1], row[2])) for row in connection.execute(
+        "SELECT path, mtime, size FROM files WHERE substr(path, 1, ?) = ?",
+        (len(root), root)))
+    counts = {'added': 0, 'updated': 0, 'removed': 0, 'unchanged': 0,
+              'errors': 0}
+    stats = {}
+    for path in _find(root_dir):
+        stat = os.stat(path)
+        stats[path] = (stat.st_mtime, stat.st_size)
+    changed = [path for path in stats if known.get(path) != stats[path]]
+    counts['unchanged'] = len(stats) - len(changed)
+    insert = ("INSERT OR REPLACE INTO files (path, mtime, size, error, %s) "
+              "VALUES (%s)" % (", ".join(_NAMES),
+                               ", ".join("?" * (len(_NAMES) + 4))))
+    for path, x3pfile, error in load_many(changed, workers=workers,
+                                          lazy=True, verify='off'):
+        if error is None:
+            row = [getter(x3pfile) for _, _, getter in COLUMNS]
+        else:
+            row = [None] * len(COLUMNS)
+            counts['errors'] += 1
+        error = None if error is None else "%s: %s" % (
+            type(error).__name__, error)
+        connection.execute(insert, [path, stats[path][0], stats[path][1],
+                                    error] + row)
+        counts['updated' if path in known else 'added'] += 1
+    removed = [(path,) for path in known if path not in stats]
+    connection.executemany("DELETE FROM files WHERE path = ?", removed)
+    counts['removed'] = len(removed)
+    connection.commit()
+    connection.close()
+    return counts
+
+
+def query(db_path, **filters):
+    '''
+    Return the sorted paths of the indexed files matching all the filters.
+    A filter is a column name (see COLUMNS) with the value to match, the
+    suffixes __min, __max and __like can be used for ranges and SQL LIKE
+    patterns, e.g. query(db, featuretype='SUR', CX_increment__max=1e-6).
+    Files that could not be read are never returned.
+    '''
+    operators = {'': '=', 'min': '>=', 'max': '<=', 'like': 'LIKE'}
+    conditions = ['error IS NULL']
+    values = []
+    for key, value in sorted(filters.items()):
+        name, _, suffix = key.partition('__')
+        if name not in _NAMES or suffix not in operators:
+            raise ValueError("Unknown filter %s." % key)
+        conditions.append("%s %s ?" % (name, operators[suffix]))
+        values.append(value)
+    connection = _connect(db_path)
+    try:
+        rows = connection.execute(
+            "SELECT path FROM files WHERE %s ORDER BY path"
+            % " AND ".join(conditions), values).fetchall()
+    finally:
+        connection.close()
+    return [row[0] for row in rows]
@@ -1,9 +1,22 @@
 from __future__ import print_function
+import os
+import copy
+import time
+import concurrent.futures
+import shutil
+import tempfile
 import zipfile
 import hashlib
 import xml.etree.ElementTree as ET
 import numpy as np
 from . import _x3pfileclasses
+from . import _bindata
+from . import _datalist
+from . import _xmlwriter
+from . import _pointcloud
+from . import _levelling
+from . import _pyramid
+from . import _tiles
 import warnings
 import logging
 try:
@@ -29,12 +42,81 @@ Issues not solved:
    - there are some problems with encoding e.g. accent, greekletters
 
 """
-__all__ = ['X3Pfile']
+__all__ = ['X3Pfile', 'X3PWriter', 'ChecksumError']
+
+
+# Compression methods that can be used for writing the archive.
+COMPRESSION = {'stored': zipfile.ZIP_STORED,
+               'deflate': zipfile.ZIP_DEFLATED,
+               'lzma': zipfile.ZIP_LZMA,
+               'bzip2': zipfile.ZIP_BZIP2,
+               }
+
+
+def _open_archive(filepath, compression, level):
+    if compression not in COMPRESSION:
+        raise ValueError("compression must be one of: %s" %
+                         ", ".join(COMPRESSION))
+    return zipfile.ZipFile(filepath, 'w', COMPRESSION[compression],
+                           compresslevel=level)
+
+
+def _axis_column(block, name, names):
+    '''
+    Return the values of the absolute axis name ('x', 'y' or 'z') from a
+    block of point data whose points contain the values of the axes names.
+    '''
+    if block.dtype.names:
+        return block[name]
+    if len(names) > 1:
+        return block[..., names.index(name)]
+    return block
+
+
+def _chunk_rows(sizeY, chunk_rows=None):
+    '''
+    Number of rows of the blocks read at a time: chunk_rows if given,
+    otherwise rows of about a million points.
+    '''
+    return chunk_rows or max((1 << 20) // max(sizeY, 1), 1)
+
+
+def _axis_scale(ax):
+    '''
+    Return the increment and the offset of an axis as floats (1 and 0 when
+    they are not set).
+    '''
+    return (1.0 if ax.increment is None else float(ax.increment),
+            0.0 if ax.offset is None else float(ax.offset))
+
+
+class ChecksumError(ValueError):
+    """Raised when a checksum stored in the archive does not match the data."""
+    pass
+
+
+def _check_checksum(name, calculated, expected):
+    if expected is None:
+        # the checksums of the binary members are optional
+        warnings.warn("No checksum of %s to verify." % name)
+        return
+    # We use as convention to convert checksum to lower case letters.
+    if calculated.lower() != expected.lower():
+        msg = "Checksum of %s doesn't match: expected %s calculated %s."
+        raise ChecksumError(msg % (name, expected, calculated))
+
 
 class X3Pfile(object):
     """docstring for x3pfile."""
-    def __init__(self, filepath=None):
-        self.data = np.array([])
+    def __init__(self, filepath=None, mmap=False, lazy=False, verify='eager',
+                 cache=None):
+        self._data = np.array([])
+        # Keeps what is needed for reading the point data when the file is
+        # loaded lazily.
+        self._pending = None
+        # index of the tiles when the point data are in the tiled layout
+        self._tiles = None
+        self.filepath = None
         self.record1 = _x3pfileclasses.Record1()
         self.record2 = _x3pfileclasses.Record2()
         self.record3 = _x3pfileclasses.Record3()
@@ -44,7 +126,49 @@ class X3Pfile(object):
         self.warnings = warnings
         self.logging = logging
         if filepath is not None:
-            self.load(filepath)
+            self.load(filepath, mmap=mmap, lazy=lazy, verify=verify,
+                      cache=cache)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # modules can not be pickled, shared memory blocks are process local
+        del state['warnings'], state['logging']
+        state.pop('_shm', None)
+        if state['_pending'] is not None:
+            state['_pending'] = dict(state['_pending'], cache=None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.warnings = warnings
+        self.logging = logging
+
+    @property
+    def data(self):
+        '''
+        The point data as a numpy (masked) array. When the file has been
+        loaded lazily the binary data are read the first time this attribute
+        is accessed.
+        '''
+        if self._pending is not None:
+            pending = self._pending
+            zfile = zipfile.ZipFile(pending['filepath'], 'r')
+            try:
+                if pending['datalist']:
+                    self._read_datalist(self._parse_mainxml(zfile)[1])
+                else:
+                    self._read_bindata(zfile, mmap=pending['mmap'],
+                                       verify=pending['verify'],
+                                       cache=pending['cache'])
+            finally:
+                zfile.close()
+            self._pending = None
+        return self._data
+
+    @data.setter
+    def data(self, array):
+        self._pending = None
+        self._data = array
 
     def convert_datatype(self, dtype):
         '''
@@ -85,21 +209,32 @@ class X3Pfile(object):
         if self.record1.featuretype is None:
             raise ValueError("Featuretype must be set before data. Use record1.set_featuretype('SUR')")
         self.data = array
-        dtype = datatypes[str(array.dtype)]
-        self.record1.axes.CX.set_datatype(dtype)
-        self.record1.axes.CY.set_datatype(dtype)
-        self.record1.axes.CZ.set_datatype(dtype)
+        if array.dtype.names:
+            # structured points: a field per absolute axis (e.g. 'x', 'y', 'z')
+            for name in array.dtype.names:
+                ax = getattr(self.record1.axes, 'C' + name.upper())
+                ax.set_datatype(datatypes[str(array.dtype[name])])
+        else:
+            dtype = datatypes[str(array.dtype)]
+            self.record1.axes.CX.set_datatype(dtype)
+            self.record1.axes.CY.set_datatype(dtype)
+            self.record1.axes.CZ.set_datatype(dtype)
+        ncomp = self._values_per_point()
         if self.record1.featuretype == 'SUR':
-            md5_bin = hashlib.md5(array.data).hexdigest()
+            md5_bin = _bindata.md5_array(np.ma.getdata(array))
             self.record3.datalink.set_PointDataLink("bindata/data.bin")
             self.record3.datalink.set_MD5ChecksumPointData(md5_bin)
             if hasattr(array,'mask'):
-                if array.mask is not False:
+                if array.mask is not np.ma.nomask:
                     print('inserting')
-                    md5_binm = hashlib.md5(~array.mask).hexdigest()
+                    md5_binm = _bindata.md5_array(
+                        _bindata.point_mask(array, ncomp), invert=True)
                     self.record3.datalink.set_ValidPointsLink("bindata/valids.bin")
                     self.record3.datalink.set_MD5ChecksumValidPoints(md5_binm)
             #self.data.data.tobytes()
+            if ncomp > 1:
+                # the values of a point are along the last axis
+                array = array[..., 0]
             if len(array.shape) == 2:
                 self.record3.matrixdimension.set_sizeX(array.shape[0])
                 self.record3.matrixdimension.set_sizeY(array.shape[1])
@@ -111,28 +246,46 @@ class X3Pfile(object):
         else:
             raise NotImplementedError("Only SUR is supported by current version.")
 
-    def load(self, filepath):
+    def load(self, filepath, mmap=False, lazy=False, verify='eager',
+             cache=None):
+        '''
+        Load an .x3p file.
+        When lazy is True only main.xml is parsed: the binary point data are
+        read, checked and decoded the first time self.data is accessed.
+        When mmap is True and the point data member is stored without
+        compression, the point data are returned as a read-only numpy.memmap
+        of the archive instead of being read in memory. Compressed members
+        are read as usual. The path used is reported in
+        self.infos['PointData'] ('mmap' or 'read').
+        The verify argument sets when the checksums are checked:
+            - 'eager' main.xml is checked on load and the binary data while
+              they are read (on first access of self.data if lazy);
+            - 'deferred' only main.xml is checked on load, the binary data
+              can be checked later calling self.verify() (e.g. in a
+              background thread);
+            - 'off' nothing is checked.
+        A ChecksumError is raised when a checksum does not match.
+        cache can be an X3PCache: the decoded point data are taken from it
+        when the checksums in Record3 match a cached entry (the archive
+        members are not read) and added to it otherwise.
+        '''
+        if verify not in ['eager', 'deferred', 'off']:
+            raise ValueError("verify must be 'eager', 'deferred' or 'off'.")
+        if not hasattr(filepath, 'read'):
+            # we store the absolute path for reading the data later
+            filepath = os.path.abspath(filepath)
+        self.filepath = filepath
+        self._pending = None
+        self._tiles = None
         # The x3p file format is zipped.
         zfile = zipfile.ZipFile(filepath, 'r')
-        # We read the md5 checksum from the file inside the .zip
-        # Note: there is also the *main.xml we use `.split` to eliminate it.
-        # We use as convention to convert checksum to lower case letters.
-        checksum_line = zfile.read('md5checksum.hex').decode('utf8')
-        checksum = checksum_line.split(' ')[0].lower()
-        # We now calculate the checksum from the main.xml.
-        checksum_calc_xml = zfile.read('main.xml')
-        checksum_calc = hashlib.md5(checksum_calc_xml).hexdigest().lower()
-        if checksum != checksum_calc:
-            print("WARNING: checksum doesn't match!")
-        tree = ET.parse(zfile.open('main.xml'))
-        root = tree.getroot()
-        # return tree,root #for debug
-        # We first get the records it would not be efficient to iter all the
-        # root because sometimes Record3 contains very long profiles
-
-        records = {}
-        for child in root:
-            records[child.tag] = child
+        self.infos['Verified'] = False
+        # main.xml is parsed incrementally and hashed on the way because
+        # sometimes Record3 contains very long profiles.
+        records, decoder, checksum_calc = self._parse_mainxml(
+            zfile, datalist=not lazy)
+        if verify != 'off':
+            self._verify_mainxml(zfile, checksum_calc)
 
         axes = None
         # We must take care that field with minOccurs = 0 could not be present
@@ -215,6 +368,12 @@ class X3Pfile(object):
         else:
             self.record2 = None
 
+        if 'VendorSpecificID' in records:
+            self.VendorSpecificID = records['VendorSpecificID'].text
+            if self.VendorSpecificID == _tiles.VENDOR_ID:
+                # the point data are in the tiled layout, see write_tiled
+                self._tiles = _tiles.read_index(zfile)
+
         # Records3 is more problematic because it could contain a lot of data
         for elem in records['Record3']:
             if elem.tag == 'MatrixDimension':
@@ -227,257 +386,1260 @@ class X3Pfile(object):
                 self.record3.datalist = False
                 # This mean that we have a binary file
                 print('Found a binary file')
-                mask = np.ma.nomask
                 for i in elem:
                     if i.tag == 'PointDataLink':
                         self.record3.datalink.set_PointDataLink(i.text)
-                        binfile = zfile.read(i.text)
                     if i.tag == 'MD5ChecksumPointData':
                         self.record3.datalink.set_MD5ChecksumPointData(i.text)
-                        # We check the checksum on the way
-                        checksum_calc = hashlib.md5(binfile).hexdigest()
-                        if checksum_calc.lower() != i.text.lower():
-                            print("Checksums bin data are different!")
-
                     if i.tag == 'ValidPointsLink':
                         self.record3.datalink.set_ValidPointsLink(i.text)
-                        validpoints = zfile.read(i.text)
-                        mask = [0 if b == 1 else 1 for b in validpoints]
-
                     if i.tag == 'MD5ChecksumValidPoints':
                         self.record3.datalink.set_MD5ChecksumValidPoints(i.text)
-                        # We check the checksum on the way
-                        checksum_calc = hashlib.md5(validpoints).hexdigest()
-                        if checksum_calc.lower() != i.text.lower():
-                            print("Checksums valid bin data are different!")
-                    axest = self.record1.axes.get_XYaxes_types()
-                    # if we have incremental axis 
-                    if axest == ['I','I']:
-                        if self.record3.matrixdimension.sizeZ == 1:
-                            size = (self.record3.matrixdimension.sizeX,
-                                    self.record3.matrixdimension.sizeY)
-                            dtypes = self.record1.axes.get_axes_dataype()
-                            if len(dtypes) == 1:
-                                dtype = self.convert_datatype(dtypes.pop())
-                                data = np.frombuffer(binfile, dtype=dtype)
-                                self.data = np.ma.masked_array(data,
-                                                            mask=mask,
-                                                            dtype=dtype
-                                                            ).reshape(size)
-                            else:
-                                msg = "Multipe datatypes not implemented"
-                                raise NotImplementedError(msg)
-
-                        elif self.record3.matrixdimension.sizeZ > 1:
-                            # This is the case of multiple layers
-                            size = (self.record3.matrixdimension.sizeZ,
-                                    self.record3.matrixdimension.sizeX,
-                                    self.record3.matrixdimension.sizeY,
-                                    )
-                            dtypes = self.record1.axes.get_axes_dataype()
-                            if len(dtypes) == 1:
-                                dtype = self.convert_datatype(dtypes.pop())
-                                data = np.frombuffer(binfile, dtype=dtype)
-                                self.data = np.ma.masked_array(data,
-                                                            mask=mask,
-                                                            dtype=dtype
-                                                            ).reshape(size)
-                            else:
-                                msg = "Multipe datatypes not implemented"
-                                raise NotImplementedError(msg)
-
-                    # for absolute axes the shape contains also the coordinates
-                    elif axest == ['A','A']:
-                        if self.record3.matrixdimension.sizeZ == 1:
-                            size = (self.record3.matrixdimension.sizeX,
-                                    self.record3.matrixdimension.sizeY,
-                                    3) # Z is set to 3 becuase it contains also the x,y coordinates
-                            dtypes = self.record1.axes.get_axes_dataype()
-                            if len(dtypes) == 1:
-                                dtype = self.convert_datatype(dtypes.pop())
-                                data = np.frombuffer(binfile, dtype=dtype)
-                                self.data = np.ma.masked_array(data,
-                                                            mask=mask,
-                                                            dtype=dtype
-                                                            ).reshape(size)
-                            else:
-                                msg = "Multipe datatypes not implemented"
-                                raise NotImplementedError(msg)
-                    else:
-                        raise NotImplementedError("Incremental and absolute axes togehter are not implemented.")
+                if lazy:
+                    self._pending = {'filepath': filepath, 'mmap': mmap,
+                                     'verify': verify, 'datalist': False,
+                                     'cache': cache}
+                else:
+                    self._read_bindata(zfile, mmap=mmap, verify=verify,
+                                       cache=cache)
 
             #np.ma.masked_array([(1,2,3),(3,4,5),(5,6,7)],dtype = [('x', 'i8'), ('y',   'f4'),('z','i8')])
 
             if elem.tag == 'DataList':
                 print('Found a datalist')
                 self.record3.datalink = False
-                datalist = []
-                # it could be reasonable to expect sizeZ to be the number of
-                # profiles
-                n_profiles = self.record3.matrixdimension.sizeZ
-                for value in elem:
-                    if value.text is None:  # it means its an invalid entry
-                    # actualy xsd:float has also a NaN value that could be used
-                        nanarr = [np.nan]*n_profiles
-                        datalist.append(nanarr)
-                    else:
-                        values = value.text.split(';')
-                        datalist.append(values)
-                        if len(values) > n_profiles:
-                            n_profiles = len(values)
-
-
-                dtypes = self.record1.axes.get_axes_dataype()
-                if len(dtypes) == 1:
-                    dtype = self.convert_datatype(dtypes.pop())
-                    data = np.array(datalist, dtype=dtype)
-                    self.data = data.T
+                # the points are in main.xml which has already been checked
+                self.infos['Verified'] = verify != 'off'
+                if lazy:
+                    self._pending = {'filepath': filepath, 'datalist': True}
+                else:
+                    self._read_datalist(decoder)
             # Record4 contains only one element
             self.record4.checksumfile = records['Record4'][0].text
+        zfile.close()
+
+    def _parse_mainxml(self, zfile, datalist=True):
+        '''
+        Parse main.xml incrementally and return the records (the children of
+        the root element), a DatalistDecoder with the points of the DataList
+        (None when datalist is False or there is no DataList) and the md5
+        checksum of main.xml computed while it is read. The Datum elements
+        are decoded in batches and removed from the tree as soon as they are
+        parsed, so the DataList is never built in memory.
+        '''
+        md5 = hashlib.md5()
+        stream = _bindata.HashingReader(zfile.open('main.xml'), md5)
+        records = {}
+        decoder = None
+        dimension = None
+        depth = 0
+        parent = None
+        try:
+            for event, elem in ET.iterparse(stream, events=('start', 'end')):
+                # Datum elements are by far the most common, we check them
+                # first.
+                if elem.tag == 'Datum':
+                    if event == 'end':
+                        if decoder is not None:
+                            decoder.add(elem.text)
+                        parent.clear()
+                elif event == 'start':
+                    depth += 1
+                    if elem.tag == 'DataList':
+                        parent = elem
+                        if datalist:
+                            decoder = self._datalist_decoder(dimension)
+                else:
+                    depth -= 1
+                    if depth == 1:
+                        records[elem.tag] = elem
+                    elif elem.tag == 'MatrixDimension':
+                        dimension = elem
+        finally:
+            stream.close()
+        return records, decoder, md5.hexdigest()
+
+    def _datalist_decoder(self, dimension):
+        '''
+        Return a DatalistDecoder sized from the MatrixDimension element.
+        '''
+        if dimension is None:
+            return _datalist.DatalistDecoder()
+        xd = dict((item.tag, item.text) for item in dimension)
+        # it could be reasonable to expect sizeZ to be the number of
+        # profiles
+        return _datalist.DatalistDecoder(
+            npoints=int(xd['SizeX']) * int(xd['SizeY']),
+            nvalues=int(xd['SizeZ']))
+
+    def _read_datalist(self, decoder):
+        '''
+        Store the points decoded from the DataList in self.data.
+        '''
+        dtypes = self.record1.axes.get_axes_dataype()
+        if len(dtypes) == 1:
+            dtype = self.convert_datatype(dtypes.pop())
+            self.data = decoder.result(dtype).T
+
+    def _point_dtype(self):
+        '''
+        Return the data type of the values of the binary point data and the
+        names of the axes ('x', 'y', 'z') having values: only the absolute
+        axes are stored. When the absolute axes have different data types
+        (e.g. float64 X and Y and int32 Z) a structured data type with a
+        field per axis is returned, and every point is a single value.
+        '''
+        axes = self.record1.axes
+        absolute = [(name, ax) for name, ax in
+                    zip('xyz', [axes.CX, axes.CY, axes.CZ])
+                    if ax.axistype == 'A']
+        names = [name for name, _ in absolute]
+        datatypes = [ax.datatype for _, ax in absolute]
+        if None in datatypes:
+            raise ValueError("The data type of the absolute axes %s is not "
+                             "set." % ", ".join(names))
+        if len(set(datatypes)) == 1:
+            return np.dtype(self.convert_datatype(datatypes[0])), names
+        return np.dtype([(name, np.dtype(self.convert_datatype(datatype)))
+                         for name, datatype in zip(names, datatypes)]), names
+
+    def _values_per_point(self):
+        dtype, names = self._point_dtype()
+        return 1 if dtype.names else len(names)
+
+    def _get_shape(self):
+        '''
+        Return the shape of the point data array according to the axes types
+        and the matrix dimension.
+        '''
+        md = self.record3.matrixdimension
+        axest = self.record1.axes.get_XYaxes_types()
+        shape = (md.sizeX, md.sizeY)
+        # for absolute axes the shape contains also the coordinates: the
+        # values of the absolute axes of a point (e.g. x, y, z or y, z when
+        # only Y is absolute) are along the last axis, unless they are
+        # structured (an axis per field). The incremental axes are not
+        # stored, see axis_values.
+        ncomp = self._values_per_point()
+        if ncomp > 1:
+            shape += (ncomp,)
+        if md.sizeZ == 1:
+            return shape
+        # This is the case of multiple layers
+        if axest == ['I','I']:
+            return (md.sizeZ,) + shape
+        raise NotImplementedError("Multiple layers with absolute axes are not implemented.")
+
+    def _read_bindata(self, zfile, mmap=False, verify='eager', cache=None):
+        '''
+        Read the point data and the valid points linked in Record3 and store
+        them in self.data as a masked array. When verify is 'eager' the
+        checksums are computed while the members are streamed. When the data
+        are found in the cache the archive is not read. Files in the tiled
+        layout (see write_tiled) are read from their tiles.
+        '''
+        size = self._get_shape()
+        dtype = self._point_dtype()[0]
+        eager = verify == 'eager'
+        if self.record3.datalink.MD5ChecksumPointData is None:
+            # the entries of the cache are keyed by the checksums
+            cache = None
+        if cache is not None:
+            key = self._cache_key(dtype, size)
+            cached = cache.get(key, verified=eager)
+            if cached is not None:
+                self.infos['PointData'] = 'cache'
+                self.infos['Verified'] = eager
+                self.data = cached.view()
+                return
+        if self._tiles is not None:
+            data, mask = self._read_tiles(zfile, eager)
+        else:
+            data, mask = self._read_members(zfile, mmap, eager)
+        self.infos['Verified'] = eager
+        self.data = np.ma.masked_array(data, mask=mask,
+                                       dtype=dtype).reshape(size)
+        # memory-mapped data are not cached, they cost nothing to map again.
+        # Data whose check is deferred are not shared: they could be corrupt.
+        if cache is not None and self.infos['PointData'] != 'mmap' and \
+                verify != 'deferred':
+            cache.put(key, self._data, verified=eager)
+
+    def _read_members(self, zfile, mmap, eager):
+        '''
+        Read the point data and the mask of the valid points (flat, with a
+        value per value of the points) from bindata/data.bin and
+        bindata/valids.bin.
+        '''
+        datalink = self.record3.datalink
+        md = self.record3.matrixdimension
+        dtype = self._point_dtype()[0]
+        ncomp = self._values_per_point()
+        offset = None
+        if mmap and zfile.filename is not None:
+            offset = _bindata.member_offset(zfile, datalink.PointDataLink)
+        if offset is not None:
+            count = zfile.getinfo(datalink.PointDataLink).file_size
+            count //= np.dtype(dtype).itemsize
+            data = np.memmap(zfile.filename, dtype=dtype, mode='r',
+                             offset=offset, shape=(count,))
+            self.infos['PointData'] = 'mmap'
+            if eager:
+                # We check the checksum on the way without reading the whole
+                # member in memory.
+                checksum_calc = _bindata.md5_member(zfile,
+                                                    datalink.PointDataLink)
+        else:
+            md5 = hashlib.md5() if eager else None
+            data = _bindata.read_member(zfile, datalink.PointDataLink, dtype,
+                                        md5=md5)
+            self.infos['PointData'] = 'read'
+            if eager:
+                checksum_calc = md5.hexdigest()
+        if eager:
+            _check_checksum(datalink.PointDataLink, checksum_calc,
+                            datalink.MD5ChecksumPointData)
+
+        mask = np.ma.nomask
+        if datalink.ValidPointsLink is not None:
+            validpoints = zfile.read(datalink.ValidPointsLink)
+            npoints = md.sizeX * md.sizeY * md.sizeZ
+            mask = _bindata.decode_validpoints(validpoints, npoints)
+            if ncomp > 1:
+                # the valid points apply to all the values of a point
+                mask = np.repeat(mask, ncomp)
+            if eager and datalink.MD5ChecksumValidPoints is not None:
+                _check_checksum(datalink.ValidPointsLink,
+                                hashlib.md5(validpoints).hexdigest(),
+                                datalink.MD5ChecksumValidPoints)
+        return data, mask
+
+    def _read_tiles(self, zfile, eager):
+        '''
+        Read the point data and the mask of the valid points (flat as in
+        _read_members) from all the tiles, decompressed in parallel. The
+        checksums are the ones of the standard layout.
+        '''
+        datalink = self.record3.datalink
+        md = self.record3.matrixdimension
+        ncomp = self._values_per_point()
+        data, mask = _tiles.read_window(zfile, self._tiles,
+                                        self._point_dtype()[0], ncomp,
+                                        range(md.sizeZ), 0, md.sizeX,
+                                        0, md.sizeY)
+        self.infos['PointData'] = 'tiles'
+        if eager:
+            _check_checksum(datalink.PointDataLink, _bindata.md5_array(data),
+                            datalink.MD5ChecksumPointData)
+            if mask is not None and datalink.MD5ChecksumValidPoints is not None:
+                _check_checksum(datalink.ValidPointsLink,
+                                _bindata.md5_array(mask, invert=True),
+                                datalink.MD5ChecksumValidPoints)
+        if mask is None:
+            return data.ravel(), np.ma.nomask
+        return data.ravel(), np.repeat(mask.ravel(), ncomp)
+
+    def _cache_key(self, dtype, size):
+        '''
+        Key of the point data in a cache: the checksums recorded in the
+        DataLink, the data type, the shape and the number of values per point
+        (the last axis of plain arrays of absolute axes).
+        '''
+        datalink = self.record3.datalink
+        return (datalink.MD5ChecksumPointData.lower(),
+                (datalink.MD5ChecksumValidPoints or '').lower(),
+                str(np.lib.format.dtype_to_descr(np.dtype(dtype))),
+                tuple(size), self._values_per_point())
+
+    @property
+    def layers(self):
+        '''
+        The layers of the point data as a sequence: layers[i] is the array of
+        shape (sizeX, sizeY) of the layer i. When the file has been loaded
+        lazily each layer is read from its position in bindata/data.bin only
+        when it is accessed (memory-mapped if the file was loaded with
+        mmap=True and the member is stored), so the other layers are never
+        decoded. As for read_region the checksums are not verified.
+        '''
+        return _Layers(self)
+
+    def iter_layers(self):
+        '''
+        Yield the layers of the point data one at a time, see layers.
+        '''
+        for i in range(self.record3.matrixdimension.sizeZ):
+            yield self.layers[i]
+
+    def _read_layer(self, layer):
+        pending = self._pending
+        if pending is None or pending['datalist'] or not pending['mmap'] or \
+                self._tiles is not None:
+            return self.read_region(layer=layer)
+        md = self.record3.matrixdimension
+        datalink = self.record3.datalink
+        size = self._get_shape()
+        if md.sizeZ > 1:
+            size = size[1:]
+        dtype = self._point_dtype()[0]
+        ncomp = self._values_per_point()
+        zfile = zipfile.ZipFile(self.filepath, 'r')
+        try:
+            offset = _bindata.member_offset(zfile, datalink.PointDataLink)
+            if offset is None:
+                return self.read_region(layer=layer)
+            data = np.memmap(zfile.filename, dtype=dtype, mode='r',
+                             offset=offset + layer * dtype.itemsize *
+                             int(np.prod(size)), shape=size)
+            mask = np.ma.nomask
+            if datalink.ValidPointsLink is not None:
+                valids = _bindata.MemberReader(zfile, datalink.ValidPointsLink)
+                try:
+                    mask = self._read_validpoints_region(valids, [layer], 0,
+                                                         md.sizeX, 0,
+                                                         md.sizeY)[0]
+                finally:
+                    valids.close()
+                if ncomp > 1:
+                    mask = np.repeat(mask[..., np.newaxis], ncomp, axis=-1)
+        finally:
+            zfile.close()
+        return np.ma.masked_array(data, mask=mask)
+
+    def read_region(self, x0=None, x1=None, y0=None, y1=None, layer=None,
+                    workers=None):
+        '''
+        Return the window data[x0:x1, y0:y1] of the point data (for every
+        layer or only for the given layer) as a masked array.
+        When the data have not been decoded yet (e.g. lazy loading) only the
+        rows of the window are read from bindata/data.bin and from the valid
+        points: stored members are read seeking directly in the archive while
+        compressed members are decompressed up to the end of the window.
+        For files in the tiled layout (see write_tiled) only the tiles
+        covering the window are decompressed, by workers threads.
+        The checksums are not verified, use self.verify() for that.
+        '''
+        return self._region(x0, x1, y0, y1, layer, workers)
+
+    def _region(self, x0, x1, y0, y1, layer, workers=None, readers=None):
+        '''
+        read_region reading the members with the given readers (see
+        _RowReader) when the window is read from the archive.
+        '''
+        md = self.record3.matrixdimension
+        xs = slice(x0, x1).indices(md.sizeX)
+        ys = slice(y0, y1).indices(md.sizeY)
+        nx, ny = max(xs[1] - xs[0], 0), max(ys[1] - ys[0], 0)
+        if layer is None:
+            layers = list(range(md.sizeZ))
+        elif 0 <= layer < md.sizeZ:
+            layers = [layer]
+        else:
+            raise IndexError("Layer %s out of range." % layer)
+        self._get_shape()  # check that the layout is supported
+        # values per point (absolute axes contain also the coordinates)
+        ncomp = self._values_per_point()
+        if self._pending is not None and self._pending['datalist']:
+            # a DataList can only be decoded entirely
+            self.data
+        if self._pending is None:
+            data = self._data.reshape((md.sizeZ, md.sizeX, md.sizeY, ncomp))
+            window = data[layers, xs[0]:xs[0] + nx, ys[0]:ys[0] + ny]
+        else:
+            window = self._read_window(layers, xs[0], nx, ys[0], ny, ncomp,
+                                       workers, readers)
+        if ncomp == 1:
+            window = window[..., 0]
+        if layer is not None or md.sizeZ == 1:
+            window = window[0]
+        return window
+
+    def _read_window(self, layers, x0, nx, y0, ny, ncomp, workers=None,
+                     readers=None):
+        '''
+        Read a window of the point data from the archive, the returned masked
+        array has shape (layers, nx, ny, ncomp). readers are the readers of
+        the point data and of the valid points members (see _RowReader), by
+        default the archive is opened for the window only.
+        '''
+        md = self.record3.matrixdimension
+        datalink = self.record3.datalink
+        dtype = self._point_dtype()[0]
+        if self._tiles is not None:
+            zfile = zipfile.ZipFile(self.filepath, 'r')
+            try:
+                data, mask = _tiles.read_window(zfile, self._tiles, dtype,
+                                                ncomp, layers, x0, nx, y0, ny,
+                                                workers)
+            finally:
+                zfile.close()
+            if mask is None:
+                return np.ma.masked_array(data)
+            mask = np.repeat(mask[..., np.newaxis], ncomp, axis=-1)
+            return np.ma.masked_array(data, mask=mask)
+        pointsize = ncomp * dtype.itemsize
+        # byte ranges of the rows of the window
+        ranges = []
+        for z in layers:
+            for x in range(x0, x0 + nx):
+                start = ((z * md.sizeX + x) * md.sizeY + y0) * pointsize
+                ranges.append((start, ny * pointsize))
+        if readers is not None:
+            return self._read_window_members(readers, layers, x0, nx, y0, ny,
+                                             ncomp, ranges)
+        with _RowReader(self) as rows:
+            return self._read_window_members(rows.readers, layers, x0, nx,
+                                             y0, ny, ncomp, ranges)
+
+    def _read_window_members(self, readers, layers, x0, nx, y0, ny, ncomp,
+                             ranges):
+        data = np.frombuffer(b''.join([readers[0].read(start, count)
+                                       for start, count in ranges]),
+                             dtype=self._point_dtype()[0])
+        data = data.reshape((len(layers), nx, ny, ncomp))
+        mask = np.ma.nomask
+        if readers[1] is not None:
+            mask = self._read_validpoints_region(readers[1], layers, x0, nx,
+                                                 y0, ny)
+            mask = np.repeat(mask[..., np.newaxis], ncomp, axis=-1)
+        return np.ma.masked_array(data, mask=mask)
+
+    def _read_validpoints_region(self, valids, layers, x0, nx, y0, ny):
+        '''
+        Read the mask of a window from the valid points member with its
+        reader valids (a _bindata.MemberReader).
+        '''
+        md = self.record3.matrixdimension
+        npoints = md.sizeX * md.sizeY * md.sizeZ
+        mask = np.zeros((len(layers), nx, ny), dtype=bool)
+        if nx == 0 or ny == 0:
+            return mask
+        size = valids.size
+        if size == npoints:
+            # one byte per point
+            buf = b''.join([valids.read((z * md.sizeX + x) * md.sizeY + y0, ny)
+                            for z in layers for x in range(x0, x0 + nx)])
+            return np.frombuffer(buf, dtype=np.uint8).reshape(mask.shape) != 1
+        # one bit per point: we read the bytes covering the rows of the
+        # window of every layer, consecutive layers can share a byte so the
+        # ranges are merged.
+        merged = []
+        for z in layers:
+            first = (z * md.sizeX + x0) * md.sizeY
+            start = min(first // 8, size)
+            stop = min(((z * md.sizeX + x0 + nx) * md.sizeY + 7) // 8, size)
+            if merged and start < merged[-1][1]:
+                merged[-1][1] = stop
+            else:
+                merged.append([start, stop])
+        buf = b''.join([valids.read(a, b - a) for a, b in merged])
+        bits = np.unpackbits(np.frombuffer(buf, dtype=np.uint8),
+                             bitorder='little')
+        for i, z in enumerate(layers):
+            first = (z * md.sizeX + x0) * md.sizeY
+            # position of the first point of the layer in the bits read
+            position = 0
+            for a, b in merged:
+                if first < b * 8:
+                    position += first - a * 8
+                    break
+                position += (b - a) * 8
+            band = np.zeros(nx * md.sizeY, dtype=bool)
+            valid = bits[position:position + band.size]
+            # missing points at the end of the buffer are valid
+            band[:valid.size] = valid == 0
+            mask[i] = band.reshape(nx, md.sizeY)[:, y0:y0 + ny]
+        return mask
+
+    def _iter_rows(self, layer=0, chunk_rows=None):
+        '''
+        Yield the first row and the data of the blocks of chunk_rows rows of
+        a layer, read in a single pass over the archive (see _RowReader).
+        '''
+        md = self.record3.matrixdimension
+        chunk_rows = _chunk_rows(md.sizeY, chunk_rows)
+        with _RowReader(self) as rows:
+            for x0 in range(0, md.sizeX, chunk_rows):
+                yield x0, rows.read(x0, x0 + chunk_rows, layer)
+
+    def axis_values(self, axis, full=False):
+        '''
+        Return the values in metres of an axis ('x', 'y' or 'z') of the point
+        data, without the rotation (see coordinates).
+        For absolute axes offset + value * increment is computed on a view of
+        the values of the axis (a field of structured points) and returned as
+        a masked array with the shape of the points. For incremental axes
+        offset + index * increment is returned as an array of shape
+        (sizeX, 1) or (sizeY,) that broadcasts against the points, or as a
+        read-only broadcast view with the shape of the points if full is
+        True.
+        '''
+        if axis not in ['x', 'y', 'z']:
+            raise ValueError("axis must be 'x', 'y' or 'z'.")
+        increment, offset = _axis_scale(
+            getattr(self.record1.axes, 'C' + axis.upper()))
+        names = self._point_dtype()[1]
+        if axis in names:
+            values = _axis_column(self.data, axis, names).astype(np.float64)
+            values *= increment
+            values += offset
+            return values
+        md = self.record3.matrixdimension
+        if axis == 'x':
+            values = np.arange(md.sizeX)[:, np.newaxis] * increment + offset
+        else:
+            values = np.arange(md.sizeY) * increment + offset
+        if full:
+            shape = self._get_shape()
+            if self._values_per_point() > 1:
+                shape = shape[:-1]
+            values = np.broadcast_to(values, shape)
+        return values
+
+    def coordinates(self, dtype=np.float64, chunk_rows=None, layer=0):
+        '''
+        Return the coordinates in metres of the points of a layer as three
+        arrays X, Y, Z of shape (sizeX, sizeY), computed as Q = R*P + T where
+        P contains the indexes (incremental axes) or the values (absolute
+        axes) multiplied by the increments, T the offsets of the axes and R
+        the rotation matrix. The rotation is applied only if the file has
+        one and it is not the identity: in that case the X and Y arrays of
+        incremental axes are read-only broadcast views (they depend only on
+        the row or on the column). Z is nan for the invalid points, and so
+        are the values of absolute X and Y axes. Incremental X and Y come
+        from the indexes of the points and are nan there only when the
+        rotation mixes the Z values in them (r13 or r23 not zero).
+        When chunk_rows is given a generator yielding X, Y, Z for blocks of
+        chunk_rows rows is returned instead, so that the coordinates of large
+        surfaces are never all in memory (lazily loaded files are read block
+        by block in a single pass over the archive).
+        '''
+        if chunk_rows is None:
+            md = self.record3.matrixdimension
+            return next(self._iter_coordinates(dtype, max(md.sizeX, 1),
+                                               layer))
+        return self._iter_coordinates(dtype, chunk_rows, layer)
+
+    def _iter_coordinates(self, dtype, chunk_rows, layer):
+        dtype = np.dtype(dtype).type
+        md = self.record3.matrixdimension
+        axes = self.record1.axes
+        increments, offsets = zip(*[_axis_scale(ax)
+                                    for ax in [axes.CX, axes.CY, axes.CZ]])
+        rotation = None
+        if self.infos['Rotation'] and \
+                not np.array_equal(axes.rotation, np.eye(3)):
+            # python floats do not change the dtype of the result
+            rotation = axes.rotation.tolist()
+        names = self._point_dtype()[1]
+        py = np.arange(md.sizeY, dtype=dtype)[np.newaxis, :]
+        for x0, block in self._iter_rows(layer, chunk_rows):
+            x1 = x0 + block.shape[0]
+            P = []
+            for name, increment in zip('xyz', increments):
+                if name in names:
+                    values = _axis_column(block, name, names).astype(dtype)
+                    values = np.ma.filled(values, np.nan)
+                elif name == 'x':
+                    values = np.arange(x0, x1, dtype=dtype)[:, np.newaxis]
+                else:
+                    values = py
+                P.append(values * dtype(increment))
+            shape = (x1 - x0, md.sizeY)
+            if rotation is None:
+                Q = [p + dtype(t) for p, t in zip(P, offsets)]
+                Q = [q if q.shape == shape else np.broadcast_to(q, shape)
+                     for q in Q]
+            else:
+                Q = []
+                for r, t in zip(rotation, offsets):
+                    q = np.full(shape, t, dtype=dtype)
+                    for coefficient, p in zip(r, P):
+                        # the zero terms are skipped: 0 * nan is nan
+                        if coefficient:
+                            q += coefficient * p
+                    Q.append(q)
+            yield Q[0], Q[1], Q[2]
+
+    def export_pointcloud(self, path, format='ply', skip_invalid=True,
+                          dtype=np.float64, chunk_rows=None, layer=0):
+        '''
+        Write the coordinates of the points of a layer (see coordinates) as
+        a point cloud: a binary PLY file ('ply'), a text file with the X Y Z
+        values of a point per line ('xyz') or a .npy array of shape
+        (points, 3) ('npy'). The coordinates are computed and written in
+        blocks of chunk_rows rows (by default about a million points), read
+        in a single pass over the archive of lazily loaded files, the
+        invalid points are dropped unless skip_invalid is False.
+        Return the number of points written.
+        '''
+        chunk_rows = _chunk_rows(self.record3.matrixdimension.sizeY,
+                                 chunk_rows)
+        with _pointcloud.PointCloudWriter(path, format, dtype) as writer:
+            for block in self.coordinates(dtype, chunk_rows, layer):
+                if skip_invalid:
+                    valid = ~np.isnan(block[2])
+                    count = np.count_nonzero(valid)
+                else:
+                    count = block[2].size
+                points = np.empty((count, 3), dtype=dtype)
+                for i, values in enumerate(block):
+                    points[:, i] = values[valid] if skip_invalid \
+                        else values.ravel()
+                writer.write(points)
+        return writer.count
+
+    def level(self, order=1, method='lstsq', inplace=True, chunk_rows=None):
+        '''
+        Remove the form of the surface: a polynomial of the given order in
+        the row and column indexes (1 for a plane) is fitted to the valid
+        points of every layer and subtracted. method can be 'lstsq' (least
+        squares) or 'robust' (iteratively reweighted least squares with
+        Tukey biweights, less sensitive to outliers and defects).
+        The normal equations are accumulated in blocks of chunk_rows rows
+        using the grid of the incremental axes, no coordinate array is
+        built. The fit is done on the stored values, so the CZ increment
+        and offset do not matter.
+        When inplace is True the form is subtracted in the buffer of
+        self.data if it is a writable float array (otherwise self.data is
+        replaced by a float64 copy) and the metadata are updated as in
+        set_data. Return the levelled data.
+        '''
+        if method not in ['lstsq', 'robust']:
+            raise ValueError("method must be 'lstsq' or 'robust'.")
+        if order < 0:
+            raise ValueError("order must be positive.")
+        if self.record1.axes.get_XYaxes_types() != ['I', 'I']:
+            raise NotImplementedError("Only incremental X and Y axes can be levelled.")
+        md = self.record3.matrixdimension
+        data = self.data
+        chunk_rows = _chunk_rows(md.sizeY, chunk_rows)
+        surfaces = data.reshape((-1, md.sizeX, md.sizeY))
+        if inplace and data.dtype.kind == 'f' and \
+                np.ma.getdata(data).flags.writeable:
+            out = surfaces
+        else:
+            dtype = data.dtype if data.dtype.kind == 'f' else np.float64
+            out = np.ma.masked_array(np.empty(surfaces.shape, dtype),
+                                     mask=np.ma.getmask(surfaces))
+        for surface, result in zip(surfaces, out):
+            coefficients = _levelling.fit(surface, order, method, chunk_rows)
+            _levelling.subtract(surface, coefficients, result, chunk_rows)
+        out = out.reshape(data.shape)
+        if inplace:
+            self.set_data(out)
+        return out
+
+    def build_pyramid(self, levels=None):
+        '''
+        Compute a multi-resolution pyramid of the heights (of the first
+        layer) of the file the data were loaded from, for previews and
+        thumbnails. Level n is the mean of the valid points of blocks of
+        2^n x 2^n points (NaN where no point is valid), by default levels
+        are added until the largest side is below 256 points.
+        The levels are stored in a sidecar archive next to the file (its
+        name followed by .pyramid), the .x3p file is not modified. The
+        pyramid is computed from the point data stored in the file: changes
+        made in memory, e.g. by level or set_data, are not taken into
+        account. Return the number of levels.
+        '''
+        if self.filepath is None or hasattr(self.filepath, 'read'):
+            raise ValueError("The file was not loaded from a path.")
+        stored = X3Pfile(self.filepath, lazy=True)
+        md = stored.record3.matrixdimension
+        datalink = stored.record3.datalink
+        if datalink is False:
+            raise NotImplementedError("Pyramids of DataList files are not implemented.")
+        if stored.record1.axes.get_XYaxes_types() != ['I', 'I']:
+            raise NotImplementedError("Only incremental X and Y axes are supported.")
+        if levels is None:
+            levels = 1
+            while max(md.sizeX, md.sizeY) > 256 << levels:
+                levels += 1
+        dtype = stored._point_dtype()[0]
+        dtype = np.float64 if dtype.itemsize > 4 else np.float32
+        # blocks with an even number of rows
+        chunk_rows = _chunk_rows(md.sizeY)
+        chunk_rows += chunk_rows % 2
+        blocks = (block for _, block in stored._iter_rows(0, chunk_rows))
+        arrays = _pyramid.build(blocks, levels, dtype)
+        _pyramid.write(self.filepath, arrays, datalink.MD5ChecksumPointData)
+        return levels
+
+    def load_level(self, n):
+        '''
+        Read the level n (1 is the first downsampled level) of the pyramid
+        stored by build_pyramid as a masked array. Only the member of the
+        level is read from the sidecar archive.
+        '''
+        if self.filepath is None or hasattr(self.filepath, 'read') or \
+                not os.path.exists(_pyramid.path(self.filepath)):
+            raise ValueError("The file has no pyramid, see build_pyramid.")
+        zfile = zipfile.ZipFile(_pyramid.path(self.filepath), 'r')
+        try:
+            manifest = _pyramid.read_manifest(zfile)
+            if manifest['PointData'] != self.record3.datalink.MD5ChecksumPointData:
+                raise ValueError("The pyramid does not match the point data.")
+            if not 1 <= n <= len(manifest['levels']):
+                raise IndexError("Level %s out of range." % n)
+            array = _pyramid.from_bytes(
+                zfile.read(manifest['levels'][n - 1]['member']))
+        finally:
+            zfile.close()
+        return np.ma.masked_invalid(array, copy=False)
+
+    def _verify_mainxml(self, zfile, checksum_calc=None):
+        '''
+        Check the checksum of main.xml against the one in md5checksum.hex.
+        If the checksum has already been calculated it can be passed as
+        checksum_calc.
+        '''
+        # Note: there is also the *main.xml we use `.split` to eliminate it.
+        checksum_line = zfile.read('md5checksum.hex').decode('utf8')
+        checksum = checksum_line.split(' ')[0].strip()
+        if checksum_calc is None:
+            checksum_calc = _bindata.md5_member(zfile, 'main.xml')
+        _check_checksum('main.xml', checksum_calc, checksum)
+
+    def verify(self):
+        '''
+        Check all the checksums of the archive the file was loaded from
+        (main.xml, point data and valid points) streaming the members in
+        chunks. It can be used after loading with verify='deferred' or
+        verify='off' and it can run in a background thread because it opens
+        its own handle on the archive. When the point data have been taken
+        from a cache the arrays served are checked instead of the members.
+        A ChecksumError is raised on mismatch, otherwise True is returned.
+        '''
+        if self.filepath is None:
+            raise ValueError("The file was not loaded from an archive.")
+        zfile = zipfile.ZipFile(self.filepath, 'r')
+        try:
+            self._verify_mainxml(zfile)
+            datalink = self.record3.datalink
+            if self.infos.get('PointData') == 'cache':
+                self._verify_data()
+            elif self._tiles is not None:
+                self._verify_tiles(zfile)
+            elif datalink is not False:
+                _check_checksum(datalink.PointDataLink,
+                                _bindata.md5_member(zfile,
+                                                    datalink.PointDataLink),
+                                datalink.MD5ChecksumPointData)
+                if datalink.ValidPointsLink is not None and \
+                        datalink.MD5ChecksumValidPoints is not None:
+                    _check_checksum(datalink.ValidPointsLink,
+                                    _bindata.md5_member(
+                                        zfile, datalink.ValidPointsLink),
+                                    datalink.MD5ChecksumValidPoints)
+        finally:
+            zfile.close()
+        self.infos['Verified'] = True
+        return True
+
+    def _verify_data(self):
+        '''
+        Check the point data in memory and their mask against the checksums
+        of Record3.
+        '''
+        datalink = self.record3.datalink
+        _check_checksum(datalink.PointDataLink,
+                        _bindata.md5_array(np.ma.getdata(self._data)),
+                        datalink.MD5ChecksumPointData)
+        if datalink.ValidPointsLink is not None and \
+                datalink.MD5ChecksumValidPoints is not None:
+            mask = _bindata.point_mask(self._data, self._values_per_point())
+            _check_checksum(datalink.ValidPointsLink,
+                            _bindata.valids_checksum(
+                                mask, datalink.MD5ChecksumValidPoints),
+                            datalink.MD5ChecksumValidPoints)
+
+    def _verify_tiles(self, zfile):
+        '''
+        Check the checksums of the point data and of the valid points of a
+        file in the tiled layout, reading a band of tiles at a time.
+        '''
+        md = self.record3.matrixdimension
+        datalink = self.record3.datalink
+        dtype = self._point_dtype()[0]
+        ncomp = self._values_per_point()
+        rows = self._tiles['tile'][0]
+        md5, md5_valids = hashlib.md5(), hashlib.md5()
+        for z in range(md.sizeZ):
+            for x0 in range(0, md.sizeX, rows):
+                data, mask = _tiles.read_window(
+                    zfile, self._tiles, dtype, ncomp, [z], x0,
+                    min(rows, md.sizeX - x0), 0, md.sizeY)
+                md5.update(data)
+                if mask is not None:
+                    md5_valids.update(~mask)
+        _check_checksum(datalink.PointDataLink, md5.hexdigest(),
+                        datalink.MD5ChecksumPointData)
+        if self._tiles['masked'] and \
+                datalink.MD5ChecksumValidPoints is not None:
+            _check_checksum(datalink.ValidPointsLink, md5_valids.hexdigest(),
+                            datalink.MD5ChecksumValidPoints)
 
-    def write(self, filepath):
+    def _write_mainxml(self, stream, precision=None):
+        '''
+        Write main.xml as utf-8 encoded bytes in a binary stream. The
+        elements are emitted directly in the stream without building an
+        ElementTree. precision is the number of significant digits of the
+        floats in the DataList.
+        '''
         # XML file creation: > check if the element present (if not mandatory)
         #                    > recreate the datastructure from the numpy arrays
-        p = ET.Element('p:ISO5436_2')
-        p.set("xmlns:p", "http://www.opengps.eu/2008/ISO5436_2")
-        p.set("xmlns:xsi", "http://www.w3.org/2001/XMLSchema-instance")
-        p.set("xsi:schemaLocation",
-              "http://www.opengps.eu/2008/ISO5436_2 http://www.opengps.eu/2008/ISO5436_2/ISO5436_2.xsd")
-        Record1 = ET.SubElement(p, 'Record1')
-        Revision = ET.SubElement(Record1, 'Revision')
-        Revision.text = self.record1.revision
-        FeatureType = ET.SubElement(Record1, 'FeatureType')
-        FeatureType.text = self.record1.featuretype
-        Axes = ET.SubElement(Record1, 'Axes')
-        CX = ET.SubElement(Axes, 'CX')
-        AxisType = ET.SubElement(CX, 'AxisType')
-        AxisType.text = self.record1.axes.CX.axistype
-        if self.record1.axes.CX.datatype is not None:
-            DataType = ET.SubElement(CX, 'DataType')
-            DataType.text = self.record1.axes.CX.datatype
-        if self.record1.axes.CX.increment is not None:
-            Increment = ET.SubElement(CX, 'Increment')
-            Increment.text = str(self.record1.axes.CX.increment)
-        if self.record1.axes.CX.offset is not None:
-            Offset = ET.SubElement(CX, 'Offset')
-            Offset.text = str(self.record1.axes.CX.offset)
-        CY = ET.SubElement(Axes, 'CY')
-        AxisType = ET.SubElement(CY, 'AxisType')
-        AxisType.text = self.record1.axes.CY.axistype
-        if self.record1.axes.CY.datatype is not None:
-            DataType = ET.SubElement(CY, 'DataType')
-            DataType.text = self.record1.axes.CY.datatype
-        if self.record1.axes.CY.increment is not None:
-            Increment = ET.SubElement(CY, 'Increment')
-            Increment.text = str(self.record1.axes.CY.increment)
-        if self.record1.axes.CY.offset is not None:
-            Offset = ET.SubElement(CY, 'Offset')
-            Offset.text = str(self.record1.axes.CY.offset)
-        CZ = ET.SubElement(Axes, 'CZ')
-        AxisType = ET.SubElement(CZ, 'AxisType')
-        AxisType.text = self.record1.axes.CZ.axistype
-        if self.record1.axes.CZ.datatype is not None:
-            DataType = ET.SubElement(CZ, 'DataType')
-            DataType.text = self.record1.axes.CZ.datatype
-        if self.record1.axes.CZ.increment is not None:
-            Increment = ET.SubElement(CZ, 'Increment')
-            Increment.text = str(self.record1.axes.CZ.increment)
-        if self.record1.axes.CZ.offset is not None:
-            Offset = ET.SubElement(CZ, 'Offset')
-            Offset.text = str(self.record1.axes.CZ.offset)
+        xml = _xmlwriter.XMLEmitter(stream)
+        xml.start('p:ISO5436_2', [
+            ("xmlns:p", "http://www.opengps.eu/2008/ISO5436_2"),
+            ("xmlns:xsi", "http://www.w3.org/2001/XMLSchema-instance"),
+            ("xsi:schemaLocation",
+             "http://www.opengps.eu/2008/ISO5436_2 http://www.opengps.eu/2008/ISO5436_2/ISO5436_2.xsd")])
+        xml.start('Record1')
+        xml.element('Revision', self.record1.revision)
+        xml.element('FeatureType', self.record1.featuretype)
+        xml.start('Axes')
+        for ax in [self.record1.axes.CX, self.record1.axes.CY,
+                   self.record1.axes.CZ]:
+            xml.start(ax.axisname)
+            xml.element('AxisType', ax.axistype)
+            if ax.datatype is not None:
+                xml.element('DataType', ax.datatype)
+            if ax.increment is not None:
+                xml.element('Increment', str(ax.increment))
+            if ax.offset is not None:
+                xml.element('Offset', str(ax.offset))
+            xml.end(ax.axisname)
         if self.infos['Rotation']:  # We chek if we have a rotation
-            Rotation = ET.SubElement(Axes, 'Rotation')
-            r11 = ET.SubElement(Rotation, 'r11')
-            r11.text = self.record1.axes.get_rotation(1, 1, as_string=True)
-            r12 = ET.SubElement(Rotation, 'r12')
-            r12.text = self.record1.axes.get_rotation(1, 2, as_string=True)
-            r13 = ET.SubElement(Rotation, 'r13')
-            r13.text = self.record1.axes.get_rotation(1, 3, as_string=True)
-            r21 = ET.SubElement(Rotation, 'r21')
-            r21.text = self.record1.axes.get_rotation(2, 1, as_string=True)
-            r22 = ET.SubElement(Rotation, 'r22')
-            r22.text = self.record1.axes.get_rotation(2, 2, as_string=True)
-            r23 = ET.SubElement(Rotation, 'r23')
-            r23.text = self.record1.axes.get_rotation(2, 3, as_string=True)
-            r31 = ET.SubElement(Rotation, 'r31')
-            r31.text = self.record1.axes.get_rotation(3, 1, as_string=True)
-            r32 = ET.SubElement(Rotation, 'r32')
-            r32.text = self.record1.axes.get_rotation(3, 2, as_string=True)
-            r33 = ET.SubElement(Rotation, 'r33')
-            r33.text = self.record1.axes.get_rotation(3, 3, as_string=True)
+            xml.start('Rotation')
+            for row in range(1, 4):
+                for col in range(1, 4):
+                    xml.element('r%s%s' % (row, col),
+                                self.record1.axes.get_rotation(
+                                    row, col, as_string=True))
+            xml.end('Rotation')
+        xml.end('Axes')
+        xml.end('Record1')
         if self.record2 is not None:
-            Record2 = ET.SubElement(p, 'Record2')
-            Date = ET.SubElement(Record2, 'Date')
-            Date.text = self.record2.date
+            xml.start('Record2')
+            xml.element('Date', self.record2.date)
             if self.record2.creator is not None:
-                Creator = ET.SubElement(Record2, 'Creator')
-                Creator.text = self.record2.creator.decode('utf-8')
-            Instrument = ET.SubElement(Record2, 'Instrument')
-            Manufacturer = ET.SubElement(Instrument, 'Manufacturer')
-            Manufacturer.text = \
-                self.record2.instrument.manufacturer.decode('utf-8')
-            Model = ET.SubElement(Instrument, 'Model')
-            Model.text = self.record2.instrument.model.decode('utf-8')
-            Serial = ET.SubElement(Instrument, 'Serial')
-            Serial.text = self.record2.instrument.serial
-            Version = ET.SubElement(Instrument, 'Version')
-            Version.text = self.record2.instrument.version
-            CalibrationDate = ET.SubElement(Record2, 'CalibrationDate')
-            CalibrationDate.text = self.record2.calibrationdate
-            ProbingSystem = ET.SubElement(Record2, 'ProbingSystem')
-            Type = ET.SubElement(ProbingSystem, 'Type')
-            Type.text = self.record2.probingsystem.type
-            Identification = ET.SubElement(ProbingSystem, 'Identification')
-            Identification.text = self.record2.probingsystem.identification
+                xml.element('Creator', self.record2.creator.decode('utf-8'))
+            xml.start('Instrument')
+            xml.element('Manufacturer',
+                        self.record2.instrument.manufacturer.decode('utf-8'))
+            xml.element('Model', self.record2.instrument.model.decode('utf-8'))
+            xml.element('Serial', self.record2.instrument.serial)
+            xml.element('Version', self.record2.instrument.version)
+            xml.end('Instrument')
+            xml.element('CalibrationDate', self.record2.calibrationdate)
+            xml.start('ProbingSystem')
+            xml.element('Type', self.record2.probingsystem.type)
+            xml.element('Identification',
+                        self.record2.probingsystem.identification)
+            xml.end('ProbingSystem')
             if self.record2.comment is not None:
-                Comment = ET.SubElement(Record2, 'Comment')
-                Comment.text = self.record2.comment.decode('utf-8')
-        Record3 = ET.SubElement(p, 'Record3')
-        MatrixDimension = ET.SubElement(Record3, 'MatrixDimension')
-        SizeX = ET.SubElement(MatrixDimension, 'SizeX')
-        SizeX.text = str(self.record3.matrixdimension.sizeX)
-        SizeY = ET.SubElement(MatrixDimension, 'SizeY')
-        SizeY.text = str(self.record3.matrixdimension.sizeY)
-        SizeZ = ET.SubElement(MatrixDimension, 'SizeZ')
-        SizeZ.text = str(self.record3.matrixdimension.sizeZ)
+                xml.element('Comment', self.record2.comment.decode('utf-8'))
+            xml.end('Record2')
+        xml.start('Record3')
+        xml.start('MatrixDimension')
+        xml.element('SizeX', str(self.record3.matrixdimension.sizeX))
+        xml.element('SizeY', str(self.record3.matrixdimension.sizeY))
+        xml.element('SizeZ', str(self.record3.matrixdimension.sizeZ))
+        xml.end('MatrixDimension')
         if self.record3.datalink is not False:
-            DataLink = ET.SubElement(Record3, 'DataLink')
-            PointDataLink = ET.SubElement(DataLink, 'PointDataLink')
-            PointDataLink.text = self.record3.datalink.PointDataLink
-            MD5ChecksumPointData = ET.SubElement(DataLink,
-                                                 'MD5ChecksumPointData')
-            MD5ChecksumPointData.text = \
-                self.record3.datalink.MD5ChecksumPointData
+            datalink = self.record3.datalink
+            xml.start('DataLink')
+            xml.element('PointDataLink', datalink.PointDataLink)
+            xml.element('MD5ChecksumPointData', datalink.MD5ChecksumPointData)
             # Check if we have also the valid points link
-            if self.record3.datalink.ValidPointsLink is not None:
-                ValidPointsLink = ET.SubElement(DataLink, 'ValidPointsLink')
-                ValidPointsLink.text = self.record3.datalink.ValidPointsLink
-                MD5ChecksumValidPoint = ET.SubElement(DataLink,
-                                                      'MD5ChecksumValidPoints')
-                MD5ChecksumValidPoint.text = \
-                    self.record3.datalink.MD5ChecksumValidPoints
+            if datalink.ValidPointsLink is not None:
+                xml.element('ValidPointsLink', datalink.ValidPointsLink)
+                xml.element('MD5ChecksumValidPoints',
+                            datalink.MD5ChecksumValidPoints)
+            xml.end('DataLink')
         elif self.record3.datalist is not False:
-            DataList = ET.SubElement(Record3, 'DataList')
-            for values in self.data.T:
-                Datum = ET.SubElement(DataList, 'Datum')
-                if not all(np.isnan(values)):
-                    Datum.text = ";".join([str(i) for i in values])
-
-        Record4 = ET.SubElement(p, 'Record4')
-        ChecksumFile = ET.SubElement(Record4, 'ChecksumFile')
-        ChecksumFile.text = self.record4.checksumfile
-        #
-        xml = ET.tostring(p, encoding='utf-8')
-        # MD5 Check sum
-        md5 = hashlib.md5(xml).hexdigest() + " *main.xml"
+            xml.start('DataList')
+            for datums in _datalist.format_datalist(self.data.T, precision):
+                xml.raw(datums)
+            xml.end('DataList')
+        xml.end('Record3')
+        xml.start('Record4')
+        xml.element('ChecksumFile', self.record4.checksumfile)
+        xml.end('Record4')
+        if self.VendorSpecificID is not None:
+            xml.element('VendorSpecificID', self.VendorSpecificID)
+        xml.end('p:ISO5436_2')
+        xml.flush()
+
+    def _write_mainxml_member(self, zf, precision=None):
+        '''
+        Write main.xml in the archive updating its md5 on the fly, then write
+        md5checksum.hex.
+        '''
+        md5 = hashlib.md5()
+        with zf.open("main.xml", 'w', force_zip64=True) as member:
+            self._write_mainxml(_bindata.HashingWriter(member, md5), precision)
+        zf.writestr("md5checksum.hex", md5.hexdigest() + " *main.xml")
+
+    def write(self, filepath, compression='stored', level=None,
+              precision=None):
+        '''
+        Write the .x3p file. The members of the archive are compressed with
+        the given compression method, level is the compression level (0-9
+        for 'deflate', 1-9 for 'bzip2', ignored by 'stored' and 'lzma',
+        None uses the default of the method).
+
+            compression   write speed   file size   notes
+            'stored'      fastest       largest     point data can be mmap'ed
+            'deflate'     medium        small       readable by every tool
+            'bzip2'       slow          small       good on integer data
+            'lzma'        slowest       smallest    slow to read too
+
+        Measured height data (float32/float64) compress poorly compared to
+        integer data, see examples/benchmark_compression.py.
+        For profiles stored in a DataList, precision is the number of
+        significant digits of the floats (by default the shortest
+        representation that reads back to the same value).
+        '''
+        if self.VendorSpecificID == _tiles.VENDOR_ID:
+            # the tiled layout is only written by write_tiled
+            return self.export_standard(filepath, compression, level)
         # WRITING INTO THE ZIP FILE ALL THE DATA
         if not filepath.endswith('.x3p'):
             filepath = "".join([filepath, '.x3p'])
-        with zipfile.ZipFile(filepath, 'w') as zf:
-            zf.writestr("md5checksum.hex", md5)
-            zf.writestr("main.xml", xml)
+        with _open_archive(filepath, compression, level) as zf:
+            self._write_mainxml_member(zf, precision)
             if self.record3.datalink is not False:
-                zf.writestr("bindata/data.bin", self.data.data.tobytes())
-            if self.record3.datalink.ValidPointsLink is not None:
-                valids = ~self.data.mask
-                zf.writestr("bindata/valids.bin", valids.tobytes())
+                _bindata.write_array(zf, "bindata/data.bin",
+                                     np.ma.getdata(self.data))
+                if self.record3.datalink.ValidPointsLink is not None:
+                    mask = _bindata.point_mask(self.data,
+                                               self._values_per_point())
+                    _bindata.write_array(zf, "bindata/valids.bin", mask,
+                                         invert=True)
+
+    def write_tiled(self, filepath, tile=1024, compression='deflate',
+                    level=None, workers=None):
+        '''
+        Write the .x3p file with the point data in a tiled layout, a vendor
+        extension declared with the VendorSpecificID: every layer is cut in
+        tiles of tile x tile points (or tile[0] x tile[1]) compressed
+        independently and indexed, so read_region on the file loaded lazily
+        decompresses only the tiles covering the window, in parallel. This
+        makes column strips and small windows of large compressed surfaces
+        fast to read, while bindata/data.bin has to be decompressed up to the
+        end of the window.
+        compression is the codec of the tiles ('deflate', 'bzip2', 'lzma' or
+        'stored') and level its level as in write, workers is the number of
+        threads compressing the tiles. The point data are read a band of
+        tiles at a time, in a single pass over the archive of lazily loaded
+        files, which are not decoded whole.
+        Record3 keeps the checksums of the standard layout. Tools that do
+        not know the extension can not read the point data: use
+        export_standard to share the file.
+        '''
+        if self.record3.datalink is False:
+            raise NotImplementedError("Profiles in a DataList can not be tiled.")
+        if compression not in _tiles.CODECS:
+            raise ValueError("compression must be one of: %s" %
+                             ", ".join(_tiles.CODECS))
+        if not filepath.endswith('.x3p'):
+            filepath = "".join([filepath, '.x3p'])
+        if np.ndim(tile) == 0:
+            tile = (tile, tile)
+        tile = (int(tile[0]), int(tile[1]))
+        md = self.record3.matrixdimension
+        self._get_shape()  # check that the layout is supported
+        ncomp = self._values_per_point()
+        masked = self.record3.datalink.ValidPointsLink is not None
+        # We write a copy of the metadata with the checksums of the point
+        # data in the standard layout.
+        metadata = copy.copy(self)
+        metadata.record3 = copy.deepcopy(self.record3)
+        metadata.VendorSpecificID = _tiles.VENDOR_ID
+        md5, md5_valids = hashlib.md5(), hashlib.md5()
+        offsets = [0]
+
+        def encode(y0):
+            return _tiles.encode(
+                data[:, y0:y0 + tile[1]],
+                None if mask is None else mask[:, y0:y0 + tile[1]],
+                compression, level)
+
+        # the tiles are stored: they are compressed on their own
+        info = zipfile.ZipInfo(_tiles.MEMBER, time.localtime()[:6])
+        info.compress_type = zipfile.ZIP_STORED
+        with _open_archive(filepath, 'deflate', None) as zf, \
+                concurrent.futures.ThreadPoolExecutor(workers) as pool, \
+                _RowReader(self) as rows:
+            with zf.open(info, 'w', force_zip64=True) as member:
+                for z in range(md.sizeZ):
+                    for x0 in range(0, md.sizeX, tile[0]):
+                        band = rows.read(x0, x0 + tile[0], z)
+                        data = np.ascontiguousarray(np.ma.getdata(band))
+                        md5.update(data)
+                        mask = None
+                        if masked:
+                            mask = _bindata.point_mask(band, ncomp)
+                            md5_valids.update(~mask)
+                        for payload in pool.map(encode,
+                                                range(0, md.sizeY, tile[1])):
+                            member.write(payload)
+                            offsets.append(offsets[-1] + len(payload))
+            zf.writestr(_tiles.INDEX, _tiles.index(
+                (md.sizeZ, md.sizeX, md.sizeY), tile, compression, masked,
+                offsets))
+            datalink = metadata.record3.datalink
+            datalink.set_MD5ChecksumPointData(md5.hexdigest())
+            if masked:
+                datalink.set_MD5ChecksumValidPoints(md5_valids.hexdigest())
+            metadata._write_mainxml_member(zf)
+
+    def export_standard(self, filepath, compression='stored', level=None):
+        '''
+        Write the .x3p file in the standard layout (bindata/data.bin and
+        bindata/valids.bin) without the tiled VendorSpecificID, e.g. to share
+        a file written with write_tiled with other tools. The arguments are
+        the same of write. Surfaces with incremental X and Y axes are
+        streamed a band of rows (or a layer) at a time with X3PWriter, in a
+        single pass over the archive of lazily loaded files, which are not
+        decoded whole.
+        '''
+        standard = copy.copy(self)
+        if standard.VendorSpecificID == _tiles.VENDOR_ID:
+            standard.VendorSpecificID = None
+        md = self.record3.matrixdimension
+        if self.record3.datalink is False or \
+                self.record1.axes.get_XYaxes_types() != ['I', 'I']:
+            return standard.write(filepath, compression, level)
+        writer = X3PWriter(filepath, standard, compression, level)
+        with writer:
+            if md.sizeZ > 1:
+                with _RowReader(self) as rows:
+                    for z in range(md.sizeZ):
+                        writer.write_layer(rows.read(0, md.sizeX, z))
+            else:
+                for _, block in self._iter_rows(0):
+                    writer.write_rows(block)
+
+
+class _RowReader(object):
+    '''
+    Reader of the blocks of rows of the point data of an X3Pfile, keeping
+    the archive open: read(x0, x1, layer) returns the same array as
+    read_region(x0, x1, layer=layer). The blocks must be read in increasing
+    order of layer and row, then compressed members are decompressed once
+    for all the blocks while read_region decompresses them from their start
+    for every block. Data in memory, DataLists and tiled files are read as
+    by read_region.
+    '''
+    def __init__(self, x3pfile):
+        self.x3pfile = x3pfile
+        self.zfile = None
+        self.readers = None
+        pending = x3pfile._pending
+        if pending is None or pending['datalist'] or \
+                x3pfile._tiles is not None:
+            return
+        datalink = x3pfile.record3.datalink
+        self.zfile = zipfile.ZipFile(x3pfile.filepath, 'r')
+        try:
+            self.readers = [None if name is None else
+                            _bindata.MemberReader(self.zfile, name)
+                            for name in [datalink.PointDataLink,
+                                         datalink.ValidPointsLink]]
+        except Exception:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def read(self, x0, x1, layer=0):
+        return self.x3pfile._region(x0, x1, None, None, layer,
+                                    readers=self.readers)
+
+    def close(self):
+        for reader in self.readers or []:
+            if reader is not None:
+                reader.close()
+        if self.zfile is not None:
+            self.zfile.close()
+            self.zfile = None
+
+
+class _Layers(object):
+    """
+    Sequence of the layers of an X3Pfile, see X3Pfile.layers.
+    """
+    def __init__(self, x3pfile):
+        self.x3pfile = x3pfile
+
+    def __len__(self):
+        return self.x3pfile.record3.matrixdimension.sizeZ
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("Layer %s out of range." % index)
+        return self.x3pfile._read_layer(index)
+
+    def __iter__(self):
+        return self.x3pfile.iter_layers()
+
+
+class X3PWriter(object):
+    """
+    Write a SUR .x3p file incrementally, without keeping the whole surface
+    in memory. The metadata are taken from an X3Pfile (record1, record2 and
+    the VendorSpecificID), the point data are given as blocks of rows:
+
+        with X3PWriter('surface.x3p', metadata) as writer:
+            for block in blocks:  # arrays of shape (rows, sizeY)
+                writer.write_rows(block)
+
+    Surfaces with many layers are written a layer at a time with
+    write_layer instead.
+
+    The rows are streamed in bindata/data.bin and their md5 is updated on the
+    way. If any point is masked the valid points are written in
+    bindata/valids.bin (they are staged in a temporary file from the first
+    invalid point, because only one member of the zip can be written at a
+    time). When the writer is closed main.xml is written with the final
+    dimensions and checksums. If an exception is raised in the with block
+    the incomplete file is removed.
+    The compression and level arguments are the same of X3Pfile.write.
+    """
+    def __init__(self, filepath, metadata, compression='stored', level=None):
+        if metadata.record1.featuretype != 'SUR':
+            raise NotImplementedError("Only SUR is supported by X3PWriter.")
+        if not filepath.endswith('.x3p'):
+            filepath = "".join([filepath, '.x3p'])
+        self.filepath = filepath
+        # We work on a copy of the metadata without the point data.
+        self.x3pfile = X3Pfile()
+        self.x3pfile.record1 = copy.deepcopy(metadata.record1)
+        self.x3pfile.record2 = copy.deepcopy(metadata.record2)
+        self.x3pfile.record4 = copy.deepcopy(metadata.record4)
+        self.x3pfile.VendorSpecificID = metadata.VendorSpecificID
+        self.x3pfile.infos = dict(metadata.infos)
+        self.dtype = None
+        self.sizeY = None
+        self.rows = 0
+        # number of layers written with write_layer
+        self.layers = 0
+        # number of points written
+        self.points = 0
+        self._md5 = hashlib.md5()
+        self._md5_valids = hashlib.md5()
+        self._masked = False
+        self._valids = tempfile.TemporaryFile()
+        self._zf = _open_archive(filepath, compression, level)
+        self._member = self._zf.open("bindata/data.bin", 'w',
+                                     force_zip64=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        elif self._zf is not None:
+            # the archive is incomplete
+            self._member.close()
+            self._zf.close()
+            self._zf = None
+            self._valids.close()
+            os.remove(self.filepath)
+
+    def write_rows(self, block):
+        '''
+        Append a block of rows (a 2D array, optionally masked, of shape
+        (rows, sizeY)) to the point data.
+        '''
+        if self.layers:
+            raise ValueError("Rows can not be added after layers.")
+        self._write_block(block)
+
+    def write_layer(self, layer):
+        '''
+        Append a layer (a 2D array, optionally masked, of shape
+        (sizeX, sizeY)) to the point data. All the layers must have the same
+        shape and dtype.
+        '''
+        if layer.ndim != 2:
+            raise ValueError("A layer must be a 2D array.")
+        if self.rows and not self.layers:
+            raise ValueError("Layers can not be added after rows.")
+        if self.layers and layer.shape[0] != self.rows // self.layers:
+            raise ValueError("All the layers must have %s rows."
+                             % (self.rows // self.layers))
+        self._write_block(layer)
+        self.layers += 1
+
+    def _write_block(self, block):
+        if block.ndim == 1:
+            block = block.reshape(1, -1)
+        if self.dtype is None:
+            self.dtype = block.dtype
+            self.sizeY = block.shape[1]
+        if block.dtype != self.dtype or block.shape[1] != self.sizeY:
+            raise ValueError("All the blocks must have dtype %s and %s columns."
+                             % (self.dtype, self.sizeY))
+        data = np.ascontiguousarray(np.ma.getdata(block))
+        self._member.write(data)
+        self._md5.update(data)
+        mask = np.ma.getmaskarray(block)
+        if not self._masked and mask.any():
+            self._masked = True
+            # the points written before the first invalid one are valid
+            ones = b'\x01' * min(self.points, _bindata.CHUNK_SIZE)
+            for start in range(0, self.points, max(len(ones), 1)):
+                valids = ones[:self.points - start]
+                self._valids.write(valids)
+                self._md5_valids.update(valids)
+        if self._masked:
+            valids = (~mask).tobytes()
+            self._valids.write(valids)
+            self._md5_valids.update(valids)
+        self.points += mask.size
+        self.rows += block.shape[0]
+
+    def close(self):
+        '''
+        Write the valid points (if any), main.xml and md5checksum.hex and close
+        the archive.
+        '''
+        if self._zf is None:
+            return
+        if self.dtype is None:
+            raise ValueError("No rows have been written.")
+        self._member.close()
+        x3pfile = self.x3pfile
+        dtype = x3pfile.convert_datatype(self.dtype.type)
+        x3pfile.record1.axes.CX.set_datatype(dtype)
+        x3pfile.record1.axes.CY.set_datatype(dtype)
+        x3pfile.record1.axes.CZ.set_datatype(dtype)
+        if self.layers:
+            size = (self.rows // self.layers, self.sizeY, self.layers)
+        else:
+            size = (self.rows, self.sizeY, 1)
+        x3pfile.record3.matrixdimension.set_sizeXYZ(size)
+        datalink = x3pfile.record3.datalink
+        datalink.set_PointDataLink("bindata/data.bin")
+        datalink.set_MD5ChecksumPointData(self._md5.hexdigest())
+        if self._masked:
+            datalink.set_ValidPointsLink("bindata/valids.bin")
+            datalink.set_MD5ChecksumValidPoints(self._md5_valids.hexdigest())
+            self._valids.seek(0)
+            with self._zf.open("bindata/valids.bin", 'w',
+                               force_zip64=True) as member:
+                shutil.copyfileobj(self._valids, member, _bindata.CHUNK_SIZE)
+        self._valids.close()
+        x3pfile._write_mainxml_member(self._zf)
+        self._zf.close()
+        self._zf = None